@@ -2,7 +2,7 @@ from PySide6.QtGui import QIcon, QFont, QPalette, QColor
 from PySide6.QtWidgets import QApplication
 from PySide6.QtCore import QObject, QThread, Signal, QEventLoop
 
-from Neo4LDAP.model.N4L_Common import Neo4jConnector
+from Neo4LDAP.model.N4L_Common import Neo4jConnector, QueryTaskGroup
 from Neo4LDAP.gui.N4L_MainWindow import MainWindow
 
 import sys
@@ -78,6 +78,8 @@ class N4LController():
 
             self.custom_queries_list = []
             self.load_custom_queries()
+
+            self.owned_nodes = None
     
             self.main_window = MainWindow(self.get_instance())
 
@@ -88,16 +90,23 @@ class N4LController():
     def get_instance(cls) -> object:
         return cls._instance
     
-    def run_in_new_thread(self, informational_popup, wait, task, *args, **kwargs) -> bool:
+    # Cancellable tasks get their own task group (task_group keyword) and a cancel button that only stops its queries
+    def run_in_new_thread(self, informational_popup, wait, task, *args, cancellable = False, **kwargs) -> bool:
         return_value = None
 
+        task_group = None
+        if cancellable :
+            task_group = QueryTaskGroup()
+            kwargs["task_group"] = task_group
+
         thread = QThread()
         worker = ModelRequestWorker(thread, task, *args, **kwargs)
         worker.moveToThread(thread)
 
         if informational_popup :
             from Neo4LDAP.gui.N4L_Popups import N4LMessageBox
-            popup = N4LMessageBox("Task in process", "This message will be closed once the task is completed, please be patient.", self.retrieve_main_window())
+            cancel_trigger = (lambda: self.cancel_running_queries(task_group)) if cancellable else None
+            popup = N4LMessageBox("Task in process", "This message will be closed once the task is completed, please be patient.", self.retrieve_main_window(), cancel_trigger = cancel_trigger)
 
             worker.task_started_signal.connect(popup.show)
             worker.task_ended_signal.connect(popup.close)
@@ -129,6 +138,7 @@ class N4LController():
     def login(self, username, password, database, bolt_uri) -> None:
         success = self.run_in_new_thread(True, True, Neo4jConnector.connect_to_neo4j, username, password, database, bolt_uri)
         if(success):
+            self.invalidate_owned_nodes()
             self.main_window.init_gui_after_login()
 
     def init_gui(self) -> None:
@@ -147,6 +157,12 @@ class N4LController():
     
     def retrieve_neo4j_stats(self) -> list:
         return Neo4jConnector.retrieve_neo4j_stats()
+
+    def retrieve_schema_catalog(self) -> dict:
+        return Neo4jConnector.retrieve_schema_catalog()
+
+    def refresh_schema_catalog(self) -> dict:
+        return Neo4jConnector.refresh_schema_catalog()
     
     def retrieve_application_base_path(self) -> str:
         return os.path.dirname(os.path.abspath(__file__))
@@ -174,15 +190,110 @@ class N4LController():
     # Ingestor
     def ingest_data_to_neo4j(self, json_files, workers, retries, is_legacy) -> None:
         from Neo4LDAP.model.N4L_Parser import upload_data
+        self.invalidate_owned_nodes()
         self.run_in_new_thread(False, False, upload_data, json_files, workers, retries, is_legacy)
 
+    def load_ingest_projection(self) -> dict:
+        from Neo4LDAP.model.N4L_Parser import DEFAULT_INGEST_PROJECTION
+
+        data_path = self.retrieve_data_path_dir()
+        if not os.path.exists(data_path) :
+            os.mkdir(data_path)
+
+        ingest_projection_json_path = self.retrieve_data_path("N4L_ingest_projection.json")
+        if os.path.exists(ingest_projection_json_path) :
+            with open(ingest_projection_json_path, "r", encoding="utf-8") as ingest_projection_file:
+                ingest_projection = dict(DEFAULT_INGEST_PROJECTION)
+                ingest_projection.update(json.load(ingest_projection_file))
+
+                return ingest_projection
+        else:
+            with open(ingest_projection_json_path, "w", encoding="utf-8") as ingest_projection_file:
+                json.dump(DEFAULT_INGEST_PROJECTION, ingest_projection_file, indent=4)
+
+            return dict(DEFAULT_INGEST_PROJECTION)
+
+    def load_query_settings(self) -> dict:
+        from Neo4LDAP.model.N4L_Cypher import DEFAULT_QUERY_SETTINGS
+
+        data_path = self.retrieve_data_path_dir()
+        if not os.path.exists(data_path) :
+            os.mkdir(data_path)
+
+        query_settings_json_path = self.retrieve_data_path("N4L_query_settings.json")
+        if os.path.exists(query_settings_json_path) :
+            with open(query_settings_json_path, "r", encoding="utf-8") as query_settings_file:
+                query_settings = dict(DEFAULT_QUERY_SETTINGS)
+                query_settings.update(json.load(query_settings_file))
+
+                return query_settings
+        else:
+            with open(query_settings_json_path, "w", encoding="utf-8") as query_settings_file:
+                json.dump(DEFAULT_QUERY_SETTINGS, query_settings_file, indent=4)
+
+            return dict(DEFAULT_QUERY_SETTINGS)
+
+    def save_query_settings(self, query_settings) -> None:
+        data_path = self.retrieve_data_path_dir()
+        if not os.path.exists(data_path) :
+            os.mkdir(data_path)
+
+        query_settings_json_path = self.retrieve_data_path("N4L_query_settings.json")
+        with open(query_settings_json_path, "w", encoding="utf-8") as query_settings_file:
+            json.dump(query_settings, query_settings_file, indent=4)
+
+    def update_query_setting(self, key, value) -> None:
+        query_settings = self.load_query_settings()
+        query_settings[key] = value
+        self.save_query_settings(query_settings)
+
+    # One JSON object per line so the log can keep growing without rewriting it
+    def append_slow_query_log(self, slow_query) -> None:
+        data_path = self.retrieve_data_path_dir()
+        if not os.path.exists(data_path) :
+            os.mkdir(data_path)
+
+        slow_queries_log_path = self.retrieve_data_path("N4L_slow_queries.jsonl")
+        with open(slow_queries_log_path, "a", encoding="utf-8") as slow_queries_file:
+            slow_queries_file.write(json.dumps(slow_query) + "\n")
+
+    def retrieve_query_timeout(self, query_type) -> int:
+        return int(self.load_query_settings()["{query_type}_timeout".format(query_type = query_type)])
+
+    def cancel_running_queries(self, task_group) -> None:
+        self.run_in_new_thread(False, False, task_group.cancel)
+
     # LDAP View
-    def request_LDAP_query(self, query_value, attribute_list, raw_query) -> None: 
+    def request_LDAP_query(self, query_value, attribute_list, raw_query, count_only = False, split_or = False) -> None: 
         from Neo4LDAP.model.N4L_Cypher import perform_query
-        self.run_in_new_thread(True, False, perform_query, query_value, attribute_list, raw_query)
+        self.run_in_new_thread(True, False, perform_query, query_value, attribute_list, raw_query, count_only, split_or, cancellable = True)
+
+    def request_values_filter(self, attribute, file_path) -> None:
+        from Neo4LDAP.model.N4L_Cypher import load_values_filter
+        values_filter = load_values_filter(attribute, file_path)
+
+        if values_filter != None :
+            self.main_window.add_query_to_panel(values_filter)
+
+    def redraw_LDAP_result_table(self, rows, owned_nodes) -> None:
+        self.main_window.redraw_LDAP_result_table(rows, owned_nodes)
+
+    def append_LDAP_result_rows(self, rows) -> None:
+        self.main_window.append_LDAP_result_rows(rows)
 
-    def redraw_LDAP_result_table(self, query_output, owned_nodes) -> None:
-        self.main_window.redraw_LDAP_result_table(query_output, owned_nodes)
+    def request_LDAP_next_page(self) -> None:
+        from Neo4LDAP.model.N4L_Cypher import perform_next_page
+        self.run_in_new_thread(False, False, perform_next_page)
+
+    def update_LDAP_result_status(self, loaded_count, total_count, has_more) -> None:
+        self.main_window.update_LDAP_result_status(loaded_count, total_count, has_more)
+
+    def request_LDAP_export(self, query_value, attribute_list, raw_query, file_path) -> None:
+        from Neo4LDAP.model.N4L_Cypher import perform_export
+        self.run_in_new_thread(True, False, perform_export, query_value, attribute_list, raw_query, file_path, cancellable = True)
+
+    def update_LDAP_export_status(self, exported_count, total_count) -> None:
+        self.main_window.update_LDAP_export_status(exported_count, total_count)
 
     # # Custom Queries
     def load_custom_queries(self) -> None:
@@ -219,6 +330,11 @@ class N4LController():
         self.save_custom_queries()
         self.update_custom_queries_view()
 
+    def request_custom_query_batch(self, indexes, output_path, export_format, workers, raw_query) -> None:
+        from Neo4LDAP.model.N4L_Cypher import run_custom_query_batch
+        custom_queries = [self.custom_queries_list[index] for index in indexes]
+        self.run_in_new_thread(True, False, run_custom_query_batch, custom_queries, output_path, export_format, workers, raw_query, cancellable = True)
+
     # # --- 
     # ---
 
@@ -229,7 +345,7 @@ class N4LController():
             targeted_check = True
         
         from Neo4LDAP.model.N4L_ACLs import check_acls
-        self.run_in_new_thread(True, False, check_acls, name_value, acl_list, depth, source_value, target_value, exclusion_list, inbound_check, targeted_check)
+        self.run_in_new_thread(True, False, check_acls, name_value, acl_list, depth, source_value, target_value, exclusion_list, inbound_check, targeted_check, cancellable = True)
 
     def redraw_ACL_graph(self, graph, root_node, inbound_check) -> None:
         self.main_window.redraw_ACL_graph(graph, root_node, inbound_check)
@@ -285,22 +401,22 @@ class N4LController():
         from Neo4LDAP.model.N4L_Cypher import perform_query
         self.change_to_LDAPView()
         self.main_window.add_query_to_panel(query_value)
-        self.run_in_new_thread(True, False, perform_query, query_value, attribute_list, raw_query)
+        self.run_in_new_thread(True, False, perform_query, query_value, attribute_list, raw_query, cancellable = True)
 
     def request_inbound_graph_from_node(self, root_node) -> None:
         from Neo4LDAP.model.N4L_ACLs import check_acls
         self.main_window.add_inbound_to_panel(root_node)
-        self.run_in_new_thread(True, False, check_acls, root_node, ["all"], '', "", "", None, True)
+        self.run_in_new_thread(True, False, check_acls, root_node, ["all"], '', "", "", None, True, cancellable = True)
 
     def request_outbound_graph_from_node(self, root_node) -> None:
         from Neo4LDAP.model.N4L_ACLs import check_acls
         self.main_window.add_outbound_to_panel(root_node)
-        self.run_in_new_thread(True, False, check_acls, root_node, ["all"], '', "", "", None, False)
+        self.run_in_new_thread(True, False, check_acls, root_node, ["all"], '', "", "", None, False, cancellable = True)
 
     def repeat_request_with_exclusion(self, excluded_node_list) -> None:
         from Neo4LDAP.model.N4L_ACLs import check_acls
         name_value, acl_list, depth_value, source_value, target_value, exclusion_list, inbound_check = self.main_window.repeat_request_with_exclusion(excluded_node_list)
-        self.run_in_new_thread(True, False, check_acls, name_value, acl_list, depth_value, source_value, target_value, exclusion_list, inbound_check)
+        self.run_in_new_thread(True, False, check_acls, name_value, acl_list, depth_value, source_value, target_value, exclusion_list, inbound_check, cancellable = True)
     
     def put_target(self, target) -> None:
         self.main_window.put_target(target)
@@ -316,6 +432,32 @@ class N4LController():
         from Neo4LDAP.model.N4L_Cypher import set_ownership
         self.run_in_new_thread(True, False, set_ownership, owned_value, node_type, node_id)
 
+    def request_bulk_ownership(self, owned_value, entries, file_path) -> None:
+        from Neo4LDAP.model.N4L_Cypher import set_bulk_ownership
+        self.run_in_new_thread(True, False, set_bulk_ownership, owned_value, entries, file_path)
+
+    # Owned node names, loaded once per database and updated in place by set_ownership
+    # so the LDAP result model can keep a reference to the same set
+    def retrieve_owned_nodes(self) -> set:
+        from Neo4LDAP.model.N4L_Cypher import retrieve_owned_nodes
+
+        if self.owned_nodes == None :
+            self.owned_nodes = set(retrieve_owned_nodes())
+
+        return self.owned_nodes
+
+    def update_owned_nodes(self, names, owned) -> None:
+        if self.owned_nodes == None :
+            return
+
+        if owned :
+            self.owned_nodes.update(names)
+        else:
+            self.owned_nodes.difference_update(names)
+
+    def invalidate_owned_nodes(self) -> None:
+        self.owned_nodes = None
+
     # ---
 
     # Popups
@@ -339,6 +481,7 @@ class N4LController():
 
     def clear_neo4j_db_data(self) -> None:
         Neo4jConnector.clear_neo4j_db_data()
+        self.invalidate_owned_nodes()
         self.update_neo4j_db_stats()
 
     # ---
\ No newline at end of file
@@ -429,8 +429,7 @@ class ACLViewerApp(ViewerApp):
         from Neo4LDAP.gui.N4L_Popups import N4LMessageBox
         text = "The following ACEs are supported in Neo4LDAP:\n\n• All\n• FirstDegree\n\nExtended ACEs:\n\n"
         
-        self.neo4j_stats = self.controller.retrieve_neo4j_stats()
-        for acl in self.neo4j_stats["ACL_Types"]:
+        for acl in self.controller.retrieve_schema_catalog()["ACLTypes"]:
             text += "• {acl}\n".format(acl = acl)
 
         N4LMessageBox("Information", text, self.controller.retrieve_main_window())
@@ -329,7 +329,7 @@ class Popups(QWidgetFactory):
         super().__init__(parent)
 
 class ViewerApp(QWidgetFactory):
-    refresh_signal = Signal(str, list)
+    refresh_signal = Signal(list, object)
     refresh_graph_signal = Signal(object, str, bool)
     no_result_signal = Signal(QObject, str)
     error_signal = Signal(QObject, str)
@@ -1,15 +1,92 @@
 from PySide6.QtGui import QColor, QKeySequence, QShortcut, QFont
-from PySide6.QtWidgets import QToolTip, QApplication, QHeaderView, QScrollArea, QTableWidget, QTableWidgetItem, QMenu
-from PySide6.QtCore import QPoint
+from PySide6.QtWidgets import QToolTip, QApplication, QHeaderView, QScrollArea, QTableWidget, QTableWidgetItem, QTableView, QMenu
+from PySide6.QtCore import QPoint, QAbstractTableModel, QModelIndex
 
 from Neo4LDAP.gui.N4L_CommonViewer import *
 
+# Result rows kept as plain strings, the view only materializes the visible cells
+class LDAPResultModel(QAbstractTableModel):
+    MULTIVALUED_KEYS = ("memberOf", "member", "serviceprincipalnames")
+
+    def __init__(self, owned_color):
+        super().__init__()
+
+        self.keys = []
+        self.values = []
+        self.owned_nodes = set()
+
+        self.font = QFont()
+        self.font.setPointSize(12)
+        self.font.setBold(False)
+
+        self.owned_color = QColor(owned_color)
+        self.default_color = QColor("white")
+
+    def rowCount(self, parent = QModelIndex()) -> int:
+        if parent.isValid() :
+            return 0
+        return len(self.keys)
+
+    def columnCount(self, parent = QModelIndex()) -> int:
+        if parent.isValid() :
+            return 0
+        return 2
+
+    def data(self, index, role = Qt.DisplayRole) -> object:
+        if not index.isValid() :
+            return None
+
+        row = index.row()
+        if role == Qt.DisplayRole :
+            if index.column() == 1 :
+                return self.values[row]
+
+            # Multi-valued attributes only show their key on the first value
+            key = self.keys[row]
+            if key in self.MULTIVALUED_KEYS and row > 0 and self.keys[row - 1] == key :
+                return ""
+            return key
+        elif role == Qt.ForegroundRole :
+            if index.column() == 1 and self.values[row] in self.owned_nodes :
+                return self.owned_color
+            return self.default_color
+        elif role == Qt.FontRole :
+            return self.font
+
+        return None
+
+    def reset_rows(self, rows, owned_nodes) -> None:
+        self.beginResetModel()
+        self.keys = [key for key, _ in rows]
+        self.values = [value for _, value in rows]
+        # Shared with the controller, no copy per query
+        self.owned_nodes = owned_nodes
+        self.endResetModel()
+
+    def append_rows(self, rows) -> None:
+        if not rows :
+            return
+
+        first_row = len(self.keys)
+        self.beginInsertRows(QModelIndex(), first_row, first_row + len(rows) - 1)
+        for key, value in rows:
+            self.keys.append(key)
+            self.values.append(value)
+        self.endInsertRows()
+
+    # Text of a cell as shown in the table
+    def cell_text(self, row, column) -> str:
+        return self.data(self.index(row, column))
+
 class LDAPViewerApp(ViewerApp):
     debug_signal = Signal(str)
     add_query_signal = Signal(str)
     update_custom_queries_signal = Signal(list)
     push_upload_debug_info_signal = Signal(str)
     update_neo4j_db_stats_signal = Signal(dict)
+    append_results_signal = Signal(list)
+    result_status_signal = Signal(int, object, bool)
+    export_status_signal = Signal(int, object)
 
     def __init__(self, controller, neo4j_stats):
         super().__init__(controller)
@@ -19,6 +96,12 @@ class LDAPViewerApp(ViewerApp):
         self.update_custom_queries_signal.connect(self.update_custom_queries)
         self.push_upload_debug_info_signal.connect(self.push_upload_debug_info)
         self.update_neo4j_db_stats_signal.connect(self.update_information_panel)
+        self.append_results_signal.connect(self.append_result_rows)
+        self.result_status_signal.connect(self.update_result_status)
+        self.export_status_signal.connect(self.update_export_status)
+
+        self.more_results = False
+        self.loading_page = False
 
         main_layout = QHBoxLayout(self)
         main_layout.setContentsMargins(0, 0, 0, 0)
@@ -152,8 +235,23 @@ class LDAPViewerApp(ViewerApp):
         self.query_input = self.create_text_field()
         self.attributes_input = self.create_text_field()
 
+        # Filters built from value lists easily exceed the default 32767 characters
+        self.query_input.setMaxLength(16777215)
+
         checkbox_container = self.create_checkbox_container("Raw output")
+
+        self.count_only_check = QCheckBox("Count only")
+        self.count_only_check.setStyleSheet(self.CHECKBOX_STYLE)
+        checkbox_container.layout().addWidget(self.count_only_check)
+
+        self.split_or_check = QCheckBox("Split OR")
+        self.split_or_check.setStyleSheet(self.CHECKBOX_STYLE)
+        checkbox_container.layout().addWidget(self.split_or_check)
+
         query_button =  self.create_button("Query", self.on_query_button_clicked) 
+        values_button = self.create_button("Values from file", self.values_from_file_popup)
+        ownership_button = self.create_button("Bulk ownership", self.bulk_ownership_popup)
+        export_button = self.create_button("Export results", self.export_results_popup)
 
         ldap_layout = QVBoxLayout(ldap_frame)
         ldap_layout.setContentsMargins(20, 20, 20, 20)
@@ -173,6 +271,9 @@ class LDAPViewerApp(ViewerApp):
         # Third row
         ldap_layout.addWidget(checkbox_container)
         ldap_layout.addWidget(query_button)
+        ldap_layout.addWidget(values_button)
+        ldap_layout.addWidget(ownership_button)
+        ldap_layout.addWidget(export_button)
 
         return ldap_frame
 
@@ -186,6 +287,11 @@ class LDAPViewerApp(ViewerApp):
         main_layout.setContentsMargins(20, 20, 20, 20)
 
         add_custom_query_button = self.create_button("Add custom query", self.add_custom_query_popup)
+        run_custom_queries_button = self.create_button("Run queries", self.custom_query_batch_popup)
+
+        custom_query_buttons_layout = QHBoxLayout()
+        custom_query_buttons_layout.addWidget(add_custom_query_button)
+        custom_query_buttons_layout.addWidget(run_custom_queries_button)
 
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
@@ -201,7 +307,7 @@ class LDAPViewerApp(ViewerApp):
         scroll_area.setWidget(self.query_rows_container)
         
         # First Row
-        main_layout.addWidget(add_custom_query_button, alignment=Qt.AlignTop)
+        main_layout.addLayout(custom_query_buttons_layout)
         main_layout.addWidget(scroll_area)
 
         return main_frame
@@ -272,8 +378,11 @@ class LDAPViewerApp(ViewerApp):
 
     # ---
 
-    def create_ldap_table(self) -> QTableWidget:
-        table  = QTableWidget(0, 2)
+    def create_ldap_table(self) -> QTableView:
+        self.ldap_result_model = LDAPResultModel(self.BUTTON_BG)
+
+        table = QTableView()
+        table.setModel(self.ldap_result_model)
         table.setColumnWidth(0, 250)
         table.setColumnWidth(1, 525)
         
@@ -281,6 +390,8 @@ class LDAPViewerApp(ViewerApp):
         table.verticalHeader().setSectionsMovable(False)
 
         table.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        # Only a sample of rows is measured to fit the value column
+        table.horizontalHeader().setResizeContentsPrecision(500)
         table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
 
         table.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
@@ -293,15 +404,15 @@ class LDAPViewerApp(ViewerApp):
         table.setFocusPolicy(Qt.StrongFocus)
 
         table.setStyleSheet("""
-            QTableWidget {{
+            QTableView {{
                 gridline-color: {background}; 
                 background-color: {background}; 
                 border: none;
             }}
-            QTableWidget::item {{
+            QTableView::item {{
                 border: none;
             }}
-            QTableWidget::item:selected {{
+            QTableView::item:selected {{
                 background-color: {selection};
                 color: white;
             }}
@@ -328,6 +439,25 @@ class LDAPViewerApp(ViewerApp):
         self.ldap_result_table = self.create_ldap_table()
 
         self.table_layout.addWidget(self.ldap_result_table)
+
+        # Paging status
+        status_container = QWidget()
+        status_container.setStyleSheet("border: none;")
+        status_layout = QHBoxLayout(status_container)
+        status_layout.setContentsMargins(0, 0, 0, 0)
+
+        self.result_status_label = self.create_label("", True)
+        self.load_more_button = self.create_button("Load more", self.request_next_page)
+        self.load_more_button.setVisible(False)
+
+        status_layout.addWidget(self.result_status_label)
+        status_layout.addStretch()
+        status_layout.addWidget(self.load_more_button)
+
+        self.table_layout.addWidget(status_container)
+
+        # Next page once the end of the loaded rows is reached
+        self.ldap_result_table.verticalScrollBar().valueChanged.connect(self.on_result_table_scrolled)
         
         main_layout = QVBoxLayout(ldap_result_frame)
         main_layout.addWidget(table_panel)
@@ -496,6 +626,19 @@ class LDAPViewerApp(ViewerApp):
         select_all_action = menu.addAction("Select All\tCtrl+A")
         clear_action = menu.addAction("Clear")
 
+        # Query plans shown for the next LDAP queries
+        menu.addSeparator()
+        plan_menu = menu.addMenu("Query plan")
+        plan_menu.setStyleSheet(self.QMENU_STYLE)
+
+        current_plan_mode = self.controller.load_query_settings()["plan_mode"]
+        plan_actions = {}
+        for plan_mode, title in [("off", "Off"), ("explain", "EXPLAIN"), ("profile", "PROFILE")]:
+            plan_action = plan_menu.addAction(title)
+            plan_action.setCheckable(True)
+            plan_action.setChecked(plan_mode == current_plan_mode)
+            plan_actions[plan_action] = plan_mode
+
         action = menu.exec_(self.debug_text.mapToGlobal(position))
         cursor = self.debug_text.textCursor()
 
@@ -505,6 +648,8 @@ class LDAPViewerApp(ViewerApp):
             self.debug_select_all()
         elif action == clear_action :
             self.debug_clear()
+        elif action in plan_actions :
+            self.controller.update_query_setting("plan_mode", plan_actions[action])
 
     def debug_copy_text(self) -> None:
         cursor = self.debug_text.textCursor()
@@ -540,27 +685,27 @@ class LDAPViewerApp(ViewerApp):
         self.ldap_result_table.selectAll()
 
     def copy_cells(self) -> None:
-        selected_items = self.ldap_result_table.selectedItems()
+        selected_indexes = sorted(self.ldap_result_table.selectionModel().selectedIndexes(), key = lambda index: (index.row(), index.column()))
         clipboard = QApplication.clipboard()
         
-        if not selected_items :
+        if not selected_indexes :
             return 
         
         selected_columns = set()
-        for item in selected_items:
-            selected_columns.add(item.column())
+        selected_rows = {}
+        for index in selected_indexes:
+            selected_columns.add(index.column())
+            selected_rows.setdefault(index.row(), {})[index.column()] = self.ldap_result_model.cell_text(index.row(), index.column())
             
         formatted_text = []
 
         if len(selected_columns) == 1 :
-            for item in selected_items:
-                formatted_text.append(item.text())
+            for row in selected_rows.values():
+                formatted_text.extend(row.values())
         else: 
-            for i in range(0, len(selected_items), 2):
-                column_0 = selected_items[i].text()
-                column_1 = ""
-                if i + 1 < len(selected_items) :
-                    column_1 = selected_items[i + 1].text()
+            for row in selected_rows.values():
+                column_0 = row.get(0, "")
+                column_1 = row.get(1, "")
 
                 if column_0 != "" :
                     formatted_text.append(f"{column_0}: {column_1}")
@@ -573,75 +718,43 @@ class LDAPViewerApp(ViewerApp):
     # ---
     
     # Utility methods
-    def redraw_gui(self, result_output, owned_nodes) -> None:
-        lines = result_output.split("\n")
-
-        old_table = self.ldap_result_table
-        self.ldap_result_table = self.create_ldap_table()
-        
-        self.ldap_result_table.setRowCount(len(lines))
+    def redraw_gui(self, rows, owned_nodes) -> None:
+        self.ldap_result_model.reset_rows(rows, owned_nodes)
+        self.ldap_result_table.scrollToTop()
 
-        memberof_key = False
-        member_key = False
-        spn_key = False
+    # Rows arrive in chunks while the query is still being consumed
+    def append_result_rows(self, rows) -> None:
+        self.ldap_result_model.append_rows(rows)
 
-        font = QFont()
-        font.setPointSize(12)
-        font.setBold(False)
+    def update_result_status(self, loaded_count, total_count, has_more) -> None:
+        self.more_results = has_more
+        self.loading_page = False
 
-        for row, line in enumerate(lines):
-            split_data = line.split(":", 1)
-            key = split_data[0].strip()
-            value = ""
-
-            if len(split_data) > 1 :
-                value = split_data[1].strip() 
-
-            if key == "" :
-                memberof_key = False
-                member_key = False
-                spn_key = False
-
-            if key == "memberOf" and not memberof_key :
-                memberof_key = True
-            elif key == "memberOf" and memberof_key :
-                key = ""
-            
-            if key == "member" and not member_key :
-                member_key = True
-            elif key == "member" and member_key :
-                key = ""
-
-            if key == "serviceprincipalnames" and not spn_key :
-                spn_key = True
-            elif key == "serviceprincipalnames" and spn_key :
-                key = ""
-
-            value_item = QTableWidgetItem(value)
-            if value in owned_nodes:
-                value_item.setForeground(QColor(self.BUTTON_BG))
-            else:
-                value_item.setForeground(QColor("white"))
-            value_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
+        if total_count == None :
+            self.result_status_label.setText("{loaded} results loaded".format(loaded = loaded_count))
+        else:
+            self.result_status_label.setText("{loaded} of {total} results loaded".format(loaded = loaded_count, total = total_count))
 
-            key_item = QTableWidgetItem(key)
-            key_item.setForeground(QColor("white"))
-            key_item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled)
+        self.load_more_button.setVisible(has_more)
 
-            key_item.setFont(font)
-            value_item.setFont(font)
+    def update_export_status(self, exported_count, total_count) -> None:
+        if total_count == None :
+            self.result_status_label.setText("{exported} results exported".format(exported = exported_count))
+        else:
+            self.result_status_label.setText("{exported} of {total} results exported".format(exported = exported_count, total = total_count))
 
-            self.ldap_result_table.setItem(row, 0, key_item)
-            self.ldap_result_table.setItem(row, 1, value_item)
+    def on_result_table_scrolled(self, value) -> None:
+        if value > 0 and value == self.ldap_result_table.verticalScrollBar().maximum() :
+            self.request_next_page()
 
-        self.table_layout.replaceWidget(old_table, self.ldap_result_table)
-        old_table.deleteLater()
+    def request_next_page(self) -> None:
+        if not self.more_results or self.loading_page :
+            return
 
-    def on_query_button_clicked(self) -> None: 
-        query_value = self.query_input.text()
-        attributes = self.attributes_input.text()
-        raw_query = self.raw_query_check.isChecked()
+        self.loading_page = True
+        self.controller.request_LDAP_next_page()
 
+    def is_valid_query(self, query_value) -> bool:
         tokens = ["&", "|", "!"]
         valid_query = True
 
@@ -655,16 +768,34 @@ class LDAPViewerApp(ViewerApp):
                     if token in query_value and "(" + token not in query_value :
                         valid_query = False
                         break
+
+        return valid_query
+
+    def retrieve_attribute_list(self, attributes) -> list:
+        attribute_list = None
+        if attributes != "" :
+            attribute_list = ["cn"]
+            for attribute in attributes.split(","):
+                if attribute != "cn" and attribute != "name" :
+                    attribute_list.append(attribute.strip())
+
+        return attribute_list
+
+    def on_query_button_clicked(self) -> None: 
+        query_value = self.query_input.text()
+        attributes = self.attributes_input.text()
+        raw_query = self.raw_query_check.isChecked()
+        count_only = self.count_only_check.isChecked()
+        split_or = self.split_or_check.isChecked()
             
-        if valid_query :
-            attribute_list = None
-            if attributes != "" :
-                attribute_list = ["cn"]
-                for attribute in attributes.split(","):
-                    if attribute != "cn" and attribute != "name" :
-                        attribute_list.append(attribute.strip())
-
-            self.controller.request_LDAP_query(query_value.strip(), attribute_list, raw_query)
+        if self.is_valid_query(query_value) :
+            attribute_list = self.retrieve_attribute_list(attributes)
+
+            self.more_results = False
+            self.result_status_label.setText("")
+            self.load_more_button.setVisible(False)
+
+            self.controller.request_LDAP_query(query_value.strip(), attribute_list, raw_query, count_only, split_or)
         else:
             self.controller.notify_no_results("The provided LDAP query is not a valid LDAP query.")
 
@@ -686,6 +817,7 @@ class LDAPViewerApp(ViewerApp):
         self.file_uploader.show()
 
     def refresh_neo4j_db_data(self) -> None:
+        self.controller.refresh_schema_catalog()
         self.controller.update_neo4j_db_stats()
 
     def clear_neo4j_db_data(self) -> None:
@@ -701,4 +833,31 @@ class LDAPViewerApp(ViewerApp):
     def add_custom_query_popup(self) -> None:
         from Neo4LDAP.gui.N4L_Popups import N4LQueryPopup
         N4LQueryPopup(self.controller, self.controller.retrieve_main_window())
-        
\ No newline at end of file
+
+    def custom_query_batch_popup(self) -> None:
+        from Neo4LDAP.gui.N4L_Popups import N4LBatchPopup
+
+        custom_queries_list = self.controller.custom_queries_list
+        if custom_queries_list :
+            N4LBatchPopup(self.controller, self.controller.retrieve_main_window(), custom_queries_list, self.controller.load_query_settings()["batch_workers"])
+        else:
+            self.controller.notify_no_results("There are no custom queries to run.")
+
+    def values_from_file_popup(self) -> None:
+        from Neo4LDAP.gui.N4L_Popups import N4LValuesPopup
+        N4LValuesPopup(self.controller, self.controller.retrieve_main_window())
+
+    # The results go straight to disk, the table is left untouched
+    def export_results_popup(self) -> None:
+        from Neo4LDAP.gui.N4L_Popups import N4LExportPopup
+
+        query_value = self.query_input.text()
+        if self.is_valid_query(query_value) :
+            attribute_list = self.retrieve_attribute_list(self.attributes_input.text())
+            N4LExportPopup(self.controller, self.controller.retrieve_main_window(), query_value.strip(), attribute_list, self.raw_query_check.isChecked())
+        else:
+            self.controller.notify_no_results("The provided LDAP query is not a valid LDAP query.")
+
+    def bulk_ownership_popup(self) -> None:
+        from Neo4LDAP.gui.N4L_Popups import N4LOwnershipPopup
+        N4LOwnershipPopup(self.controller, self.controller.retrieve_main_window())
@@ -75,8 +75,17 @@ class MainWindow(QMainWindow):
     def update_custom_queries_view(self, custom_queries_list) -> None:
         self.LDAPViewer_handler.update_custom_queries_signal.emit(custom_queries_list)
 
-    def redraw_LDAP_result_table(self, query_output, owned_nodes) -> None:
-        self.LDAPViewer_handler.refresh_signal.emit(query_output, owned_nodes)
+    def redraw_LDAP_result_table(self, rows, owned_nodes) -> None:
+        self.LDAPViewer_handler.refresh_signal.emit(rows, owned_nodes)
+
+    def append_LDAP_result_rows(self, rows) -> None:
+        self.LDAPViewer_handler.append_results_signal.emit(rows)
+
+    def update_LDAP_result_status(self, loaded_count, total_count, has_more) -> None:
+        self.LDAPViewer_handler.result_status_signal.emit(loaded_count, total_count, has_more)
+
+    def update_LDAP_export_status(self, exported_count, total_count) -> None:
+        self.LDAPViewer_handler.export_status_signal.emit(exported_count, total_count)
 
     def add_query_to_panel(self, query) -> None:
         self.LDAPViewer_handler.add_query_signal.emit(query)
@@ -485,9 +485,11 @@ class N4LShadowRelationshiphs(Popups):
         self.close()
 
 class N4LMessageBox(Popups):
-    def __init__(self, title, message, parent, height = 300, width = 400):
+    def __init__(self, title, message, parent, height = 300, width = 400, cancel_trigger = None):
         super().__init__(parent)
 
+        self.cancel_trigger = cancel_trigger
+
         message_frame = QFrame()
         message_frame.setStyleSheet("""
             QFrame {{
@@ -503,8 +505,14 @@ class N4LMessageBox(Popups):
         title_label.setAlignment(Qt.AlignCenter)
 
         self.message_text = self.create_popup_text_field(message)        
-        close_button = self.create_button("OK", self.close)
+
+        # Running tasks that can be stopped show a cancel button instead
+        if cancel_trigger == None :
+            close_button = self.create_button("OK", self.close)
+        else:
+            close_button = self.create_button("Cancel", self.cancel_task)
         close_button.setFixedSize(150, 35)
+        self.close_button = close_button
 
         message_layout = QVBoxLayout(message_frame)
         message_layout.setContentsMargins(10, 10, 10, 10)
@@ -527,6 +535,12 @@ class N4LMessageBox(Popups):
         self.move(x, y)
         self.show()
 
+    # The popup is closed once the task ends
+    def cancel_task(self) -> None:
+        self.close_button.setEnabled(False)
+        self.message_text.setText("Cancelling the running queries, this message will be closed once they are stopped.")
+        self.cancel_trigger()
+
 class N4LQuestionBox(Popups):
     
     decision_made = Signal(bool)
@@ -698,4 +712,311 @@ class N4LQueryPopup(Popups):
                 text = "LDAP query can't be empty"
             else:
                 text = "The provided LDAP query is not a valid LDAP query"
-            N4LMessageBox("Error", text, self, 300, 350)
\ No newline at end of file
+            N4LMessageBox("Error", text, self, 300, 350)
+
+class N4LValuesPopup(Popups):
+    def __init__(self, controller, parent, height = 260, width = 400):
+        super().__init__(parent)
+
+        self.controller = controller
+
+        message_frame = QFrame()
+        message_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.POPUP_BG, border = self.PANELS_BD))
+
+        title_label = self.create_label("Values from file", True, self.MESSAGE_TITLE_STYLE, 40)
+        title_label.setAlignment(Qt.AlignCenter)
+
+        input_frame = QFrame()
+        input_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.SUBPANELS_BG, border = self.PANELS_BD))
+
+        self.attribute_input = self.create_text_field("Attribute", "samaccountname")
+        self.path_input = self.create_text_field("File path (one value per line)")
+
+        self.attribute_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+        self.path_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+
+        input_layout = QVBoxLayout(input_frame)
+        input_layout.setSpacing(5)
+
+        input_layout.addWidget(self.attribute_input)
+        input_layout.addWidget(self.path_input)
+
+        buttoms_layout = QHBoxLayout()
+
+        self.load_button = self.create_button("Load", self.load)
+        self.close_button = self.create_button("Close", self.close)
+
+        buttoms_layout.addWidget(self.load_button)
+        buttoms_layout.addWidget(self.close_button)
+
+        message_layout = QVBoxLayout(message_frame)
+        message_layout.setSpacing(7)
+
+        message_layout.addWidget(title_label)
+        message_layout.addWidget(input_frame)
+        message_layout.addLayout(buttoms_layout)
+
+        self.setFixedSize(width,height)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.addWidget(message_frame)
+
+        x = (parent.width() - self.width()) // 2
+        y = (parent.height() - self.height()) // 2
+
+        self.move(x, y)
+        self.show()
+
+    def load(self) -> None:
+        attribute = self.attribute_input.text().strip()
+        file_path = self.path_input.text().strip()
+
+        if attribute == "" or not re.match(r"^[\w-]+$", attribute) :
+            N4LMessageBox("Error", "The provided attribute is not valid", self, 300, 350)
+        elif not os.path.isfile(file_path) :
+            N4LMessageBox("Error", "The specified path is not valid", self, 300, 350)
+        else:
+            self.controller.request_values_filter(attribute, file_path)
+            self.close()
+
+class N4LExportPopup(Popups):
+    def __init__(self, controller, parent, query_value, attribute_list, raw_query, height = 220, width = 400):
+        super().__init__(parent)
+
+        self.controller = controller
+        self.query_value = query_value
+        self.attribute_list = attribute_list
+        self.raw_query = raw_query
+
+        message_frame = QFrame()
+        message_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.POPUP_BG, border = self.PANELS_BD))
+
+        title_label = self.create_label("Export results", True, self.MESSAGE_TITLE_STYLE, 40)
+        title_label.setAlignment(Qt.AlignCenter)
+
+        input_frame = QFrame()
+        input_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.SUBPANELS_BG, border = self.PANELS_BD))
+
+        self.path_input = self.create_text_field("File path (.csv or .jsonl)")
+        self.path_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+
+        input_layout = QVBoxLayout(input_frame)
+        input_layout.setSpacing(5)
+
+        input_layout.addWidget(self.path_input)
+
+        buttoms_layout = QHBoxLayout()
+
+        self.export_button = self.create_button("Export", self.export)
+        self.close_button = self.create_button("Close", self.close)
+
+        buttoms_layout.addWidget(self.export_button)
+        buttoms_layout.addWidget(self.close_button)
+
+        message_layout = QVBoxLayout(message_frame)
+        message_layout.setSpacing(7)
+
+        message_layout.addWidget(title_label)
+        message_layout.addWidget(input_frame)
+        message_layout.addLayout(buttoms_layout)
+
+        self.setFixedSize(width,height)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.addWidget(message_frame)
+
+        x = (parent.width() - self.width()) // 2
+        y = (parent.height() - self.height()) // 2
+
+        self.move(x, y)
+        self.show()
+
+    def export(self) -> None:
+        file_path = self.path_input.text().strip()
+        directory = os.path.dirname(os.path.abspath(file_path))
+
+        if not file_path.lower().endswith((".csv", ".jsonl")) :
+            N4LMessageBox("Error", "The file must end in .csv or .jsonl", self, 300, 350)
+        elif not os.path.isdir(directory) :
+            N4LMessageBox("Error", "The specified directory doesn't exist", self, 300, 350)
+        else:
+            self.controller.request_LDAP_export(self.query_value, self.attribute_list, self.raw_query, file_path)
+            self.close()
+
+class N4LOwnershipPopup(Popups):
+    def __init__(self, controller, parent, height = 420, width = 450):
+        super().__init__(parent)
+
+        self.controller = controller
+
+        message_frame = QFrame()
+        message_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.POPUP_BG, border = self.PANELS_BD))
+
+        title_label = self.create_label("Bulk ownership", True, self.MESSAGE_TITLE_STYLE, 40)
+        title_label.setAlignment(Qt.AlignCenter)
+
+        input_frame = QFrame()
+        input_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.SUBPANELS_BG, border = self.PANELS_BD))
+
+        self.entries_input = self.create_popup_text_field(None, "Names or SIDs, one per line")
+        self.entries_input.setReadOnly(False)
+        self.path_input = self.create_text_field("File path (optional, one entry per line)")
+
+        self.path_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+
+        input_layout = QVBoxLayout(input_frame)
+        input_layout.setSpacing(5)
+
+        input_layout.addWidget(self.entries_input)
+        input_layout.addWidget(self.path_input)
+
+        buttoms_layout = QHBoxLayout()
+
+        self.mark_button = self.create_button("Mark owned", lambda: self.apply(True))
+        self.unmark_button = self.create_button("Unmark owned", lambda: self.apply(False))
+        self.close_button = self.create_button("Close", self.close)
+
+        buttoms_layout.addWidget(self.mark_button)
+        buttoms_layout.addWidget(self.unmark_button)
+        buttoms_layout.addWidget(self.close_button)
+
+        message_layout = QVBoxLayout(message_frame)
+        message_layout.setSpacing(7)
+
+        message_layout.addWidget(title_label)
+        message_layout.addWidget(input_frame)
+        message_layout.addLayout(buttoms_layout)
+
+        self.setFixedSize(width,height)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.addWidget(message_frame)
+
+        x = (parent.width() - self.width()) // 2
+        y = (parent.height() - self.height()) // 2
+
+        self.move(x, y)
+        self.show()
+
+    def apply(self, owned) -> None:
+        entries = self.entries_input.toPlainText().splitlines()
+        file_path = self.path_input.text().strip()
+
+        if file_path != "" and not os.path.isfile(file_path) :
+            N4LMessageBox("Error", "The specified path is not valid", self, 300, 350)
+        elif file_path == "" and self.entries_input.toPlainText().strip() == "" :
+            N4LMessageBox("Error", "Provide names, SIDs or a file", self, 300, 350)
+        else:
+            self.controller.request_bulk_ownership(owned, entries, file_path)
+            self.close()
+
+class N4LBatchPopup(Popups):
+    def __init__(self, controller, parent, custom_queries_list, batch_workers, height = 480, width = 450):
+        super().__init__(parent)
+
+        self.controller = controller
+        self.batch_workers = batch_workers
+
+        message_frame = QFrame()
+        message_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.POPUP_BG, border = self.PANELS_BD))
+
+        title_label = self.create_label("Run custom queries", True, self.MESSAGE_TITLE_STYLE, 40)
+        title_label.setAlignment(Qt.AlignCenter)
+
+        input_frame = QFrame()
+        input_frame.setStyleSheet("background-color: {background}; border: 1px solid {border}; border-radius: 10px; ".format(background = self.SUBPANELS_BG, border = self.PANELS_BD))
+
+        queries_widget = QWidget()
+        queries_widget.setStyleSheet("background-color: {background}; border: none;".format(background = self.SUBPANELS_BG))
+
+        queries_layout = QVBoxLayout(queries_widget)
+        queries_layout.setAlignment(Qt.AlignTop)
+
+        self.query_checks = []
+        for custom_query in custom_queries_list:
+            query_check = QCheckBox(custom_query["name"])
+            query_check.setStyleSheet(self.CHECKBOX_STYLE)
+            query_check.setChecked(True)
+
+            queries_layout.addWidget(query_check)
+            self.query_checks.append(query_check)
+
+        scroll_area = QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setStyleSheet(self.QSCROLLBAR_STYLE)
+        scroll_area.setWidget(queries_widget)
+
+        self.path_input = self.create_text_field("Output directory")
+        self.format_input = self.create_text_field("Format (csv or jsonl)", "csv")
+        self.workers_input = self.create_text_field("Parallel queries", str(batch_workers))
+        self.workers_input.setValidator(QIntValidator(1, 32))
+
+        self.path_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+        self.format_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+        self.workers_input.setAlignment(Qt.AlignTop | Qt.AlignCenter)
+
+        checkbox_container = self.create_checkbox_container("Raw output")
+
+        input_layout = QVBoxLayout(input_frame)
+        input_layout.setSpacing(5)
+
+        input_layout.addWidget(scroll_area)
+        input_layout.addWidget(self.path_input)
+        input_layout.addWidget(self.format_input)
+        input_layout.addWidget(self.workers_input)
+        input_layout.addWidget(checkbox_container)
+
+        buttoms_layout = QHBoxLayout()
+
+        self.run_button = self.create_button("Run", self.run)
+        self.close_button = self.create_button("Close", self.close)
+
+        buttoms_layout.addWidget(self.run_button)
+        buttoms_layout.addWidget(self.close_button)
+
+        message_layout = QVBoxLayout(message_frame)
+        message_layout.setSpacing(7)
+
+        message_layout.addWidget(title_label)
+        message_layout.addWidget(input_frame)
+        message_layout.addLayout(buttoms_layout)
+
+        self.setFixedSize(width,height)
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.addWidget(message_frame)
+
+        x = (parent.width() - self.width()) // 2
+        y = (parent.height() - self.height()) // 2
+
+        self.move(x, y)
+        self.show()
+
+    def run(self) -> None:
+        indexes = [index for index, query_check in enumerate(self.query_checks) if query_check.isChecked()]
+        output_path = self.path_input.text().strip()
+        export_format = self.format_input.text().strip().lower().lstrip(".")
+        workers = self.workers_input.text().strip()
+
+        if not indexes :
+            N4LMessageBox("Error", "Select at least one custom query", self, 300, 350)
+        elif not os.path.isdir(output_path) :
+            N4LMessageBox("Error", "The specified directory doesn't exist", self, 300, 350)
+        elif export_format not in ("csv", "jsonl") :
+            N4LMessageBox("Error", "The format must be csv or jsonl", self, 300, 350)
+        elif not workers.isdigit() or int(workers) < 1 :
+            N4LMessageBox("Error", "Parallel queries must be a number greater than 0", self, 300, 350)
+        else:
+            if int(workers) != self.batch_workers :
+                self.controller.update_query_setting("batch_workers", int(workers))
+
+            self.controller.request_custom_query_batch(indexes, output_path, export_format, int(workers), self.raw_query_check.isChecked())
+            self.close()
@@ -23,7 +23,7 @@ DEFAULT_ACL_VALUE = {
     "Owns": 3,
     "ReadGMSAPassword": 4,
     "ReadLAPSPassword": 4,
-    "SyncLapsPassword": 4,
+    "SyncLAPSPassword": 4,
     "WriteDACL": 3,
     "WriteOwner": 3,
     "WriteSPN": 2,
@@ -52,7 +52,7 @@ CURRENT_ACL_VALUE = {
     "Owns": 3,
     "ReadGMSAPassword": 4,
     "ReadLAPSPassword": 4,
-    "SyncLapsPassword": 4,
+    "SyncLAPSPassword": 4,
     "WriteDACL": 3,
     "WriteOwner": 3,
     "WriteSPN": 2,
@@ -63,6 +63,12 @@ CURRENT_ACL_VALUE = {
     "MemberOf": 5,
 }
 
+# Composite ACEs materialized at ingest time, the ACEs that compose them list the composites they belong to in composite_of
+COMPOSITE_ACES = {
+    "DCSync": ("GetChanges", "GetChangesAll"),
+    "SyncLAPSPassword": ("GetChanges", "GetChangesInFilteredSet")
+}
+
 class ACLGraph:
     def __init__(self):
         self.graph = nx.DiGraph()
@@ -227,42 +233,6 @@ class ACLGraph:
                             if acl not in self.acls_by_nodes[source][target] :
                                 self.acls_by_nodes[source][target].append(acl)
 
-
-        # Custom ACLs
-        replacement_rules = {
-            ("GetChanges", "GetChangesAll"): "DCSync",
-            ("GetChanges", "GetChangesInFilteredSet"): "SyncLAPSPassword"
-        }
-
-        for _, targets in self.acls_by_nodes.items():
-            for _, acl_list in list(targets.items()):
-                acl_set = set(acl_list)
-                remove_set = set()
-                add_set = set()
-
-                for required_acls, replacement_acl in replacement_rules.items():
-                    has_all_acls = True
-                    for acl in required_acls:
-                        if acl not in acl_set:
-                            has_all_acls = False
-                            break
-
-                    if has_all_acls :
-                        add_set.add(replacement_acl)
-                        remove_set.update(required_acls)
-
-                # Re ingest the acls without the deleted ones
-                updated_acl_list = []
-                for acl in acl_list:
-                    if acl not in remove_set:
-                        updated_acl_list.append(acl)
-
-                for acl in add_set:
-                    if acl not in acl_list:
-                        updated_acl_list.append(acl)
-
-                acl_list[:] = updated_acl_list
-
         return node_list
     
     # ---
@@ -304,43 +274,49 @@ def draw_acl_graph(graph, name, inbound_check) -> None:
     controller = N4LController().get_instance()
     controller.redraw_ACL_graph(graph, root_node, inbound_check)
 
-def retrieve_acls_by_depth(acl_graph, name, root_node, acl_list, depth, level, exclusion_list = None) -> None:
+def retrieve_acls_by_depth(acl_graph, task, name, root_node, acl_list, composite_filter, depth, level, exclusion_list = None) -> None:
     with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
         try:
             query = """
             MATCH (n) 
-            WHERE toUpper(n.name) = toUpper('{name}') 
+            WHERE toUpper(n.name) = toUpper($name) 
             MATCH (m) 
             WHERE NOT coalesce(m.name, '') = n.name 
             MATCH p=(n)-[r:{acl}*..1]->(m)
+            {composite_filter}
             RETURN p as path
-            """.format(name = name, acl = acl_list)
+            """.format(acl = acl_list, composite_filter = composite_filter)
 
-            result = session.run(query)
-            nodes = acl_graph.populate_graph(result, root_node, exclusion_list)
+            result = session.run(task.create_query(query), name = name)
+            nodes = acl_graph.populate_graph(task.track(result), root_node, exclusion_list)
             if level < depth :
                 for node in nodes:
-                    retrieve_acls_by_depth(acl_graph, node, root_node, acl_list, depth, level + 1, exclusion_list)   
-        except:
+                    retrieve_acls_by_depth(acl_graph, task, node, root_node, acl_list, composite_filter, depth, level + 1, exclusion_list)   
+        except Exception as error:
+            # Interruptions stop the whole search, they are reported once by check_acls
+            if task.is_interrupted(error) :
+                raise
+
             controller = N4LController().get_instance()
             controller.notify_error(traceback.format_exc())
 
-def retrieve_acls_by_target(acl_graph, source_node, target_node, acl_list, exclusion_list = None) -> None:
+def retrieve_acls_by_target(acl_graph, task, source_node, target_node, acl_list, composite_filter, exclusion_list = None) -> None:
     with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
         try:
             query = """
             MATCH (n)
-            WHERE toUpper(n.name) = toUpper('{source_node}')
+            WHERE toUpper(n.name) = toUpper($source_node)
             MATCH (m)
-            WHERE toUpper(m.name) = toUpper('{target_node}')
+            WHERE toUpper(m.name) = toUpper($target_node)
             MATCH p = shortestPath((n)-[r:{acl}*]->(m))
+            {composite_filter}
             RETURN p as path
-            """.format(source_node = source_node, target_node = target_node, acl = acl_list)
+            """.format(acl = acl_list, composite_filter = composite_filter)
             
-            result = session.run(query)
+            result = session.run(task.create_query(query), source_node = source_node, target_node = target_node)
 
             node_pairs = []
-            for record in result:
+            for record in task.track(result):
                 path = record["path"]
                 nodes = path.nodes
                 for i in range(len(nodes) - 1):
@@ -354,38 +330,48 @@ def retrieve_acls_by_target(acl_graph, source_node, target_node, acl_list, exclu
             MATCH (m)
             WHERE toUpper(m.name) = toUpper(pair[1])
             MATCH (n)-[r:{acl}*..1]->(m)
+            {composite_filter}
             UNWIND r AS rel
             RETURN n.name AS source, m.name AS target, collect(DISTINCT type(rel)) AS acls
-            """.format(acl = acl_list)
+            """.format(acl = acl_list, composite_filter = composite_filter)
 
-            enrichment_result = session.run(acl_enrichment_query, {"pairs": node_pairs})
+            enrichment_result = session.run(task.create_query(acl_enrichment_query), {"pairs": node_pairs})
             
             enriched_acls = []
-            for record in enrichment_result:
+            for record in task.track(enrichment_result):
                 enriched_acls.append((record["source"], record["target"], record["acls"]))
 
-            result = session.run(query)
-            acl_graph.populate_graph(result, source_node, exclusion_list, False, True, enriched_acls)
+            result = session.run(task.create_query(query), source_node = source_node, target_node = target_node)
+            acl_graph.populate_graph(task.track(result), source_node, exclusion_list, False, True, enriched_acls)
+
+        except Exception as error:
+            # Interruptions stop the whole search, they are reported once by check_acls
+            if task.is_interrupted(error) :
+                raise
 
-        except:
             controller = N4LController().get_instance()
             controller.notify_error(traceback.format_exc())
 
-def retrieve_inbound_acls(acl_graph, name, root_node, acl_list, exclusion_list = None) -> None:
+def retrieve_inbound_acls(acl_graph, task, name, root_node, acl_list, composite_filter, exclusion_list = None) -> None:
     with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
         try:
             query = """
             MATCH (n) 
-            WHERE toUpper(n.name) = toUpper('{name}') 
+            WHERE toUpper(n.name) = toUpper($name) 
             MATCH (m) 
             WHERE NOT coalesce(m.name, '') = n.name 
             MATCH p=(n)<-[r:{acl}*..1]-(m)
+            {composite_filter}
             RETURN p as path
-            """.format(name = name, acl = acl_list)
+            """.format(acl = acl_list, composite_filter = composite_filter)
                 
-            result = session.run(query)
-            acl_graph.populate_graph(result, root_node, exclusion_list, True)
-        except:
+            result = session.run(task.create_query(query), name = name)
+            acl_graph.populate_graph(task.track(result), root_node, exclusion_list, True)
+        except Exception as error:
+            # Interruptions stop the whole search, they are reported once by check_acls
+            if task.is_interrupted(error) :
+                raise
+
             controller = N4LController().get_instance()
             controller.notify_error(traceback.format_exc())
 
@@ -403,7 +389,7 @@ def reset_actual_acl_weights() -> dict:
 
 def retrieve_acl_list(acls) -> list:
     controller = N4LController().get_instance()
-    neo4j_acls = controller.retrieve_neo4j_stats()["ACL_Types"]
+    neo4j_acls = controller.retrieve_schema_catalog()["ACLTypes"]
     
     valid_acls = {}
     for acl in neo4j_acls:
@@ -435,10 +421,37 @@ def retrieve_acl_list(acls) -> list:
     
     return acl_list
 
-def check_acls(name, acls, depth, source_node, target_node, exclusion_list = None, inbound_check = False, targeted_check = False) -> None:
+# Components are hidden on the pairs where a requested composite ACE replaces them,
+# unless the component itself was explicitly requested (All and FirstDegree requests name none)
+def retrieve_composite_filter(acl_list, acls) -> str:
+    acl_types = acl_list.split("|")
+    requested_acls = [acl.lower() for acl in acls]
+    if requested_acls in (["all"], ["firstdegree"]) :
+        requested_acls = []
+
+    composite_aces = [composite_ace for composite_ace in COMPOSITE_ACES if composite_ace in acl_types]
+    hidden_aces = []
+    for composite_ace in composite_aces:
+        for component_ace in COMPOSITE_ACES[composite_ace]:
+            if component_ace in acl_types and component_ace.lower() not in requested_acls and component_ace not in hidden_aces :
+                hidden_aces.append(component_ace)
+
+    if not hidden_aces :
+        return ""
+
+    return "WHERE NONE(rel IN r WHERE type(rel) IN {hidden} AND ANY(composite IN coalesce(rel.composite_of, []) WHERE composite IN {composites}))".format(
+        hidden = "[" + ", ".join("'{acl}'".format(acl = acl) for acl in hidden_aces) + "]",
+        composites = "[" + ", ".join("'{acl}'".format(acl = acl) for acl in composite_aces) + "]"
+    )
+
+def check_acls(name, acls, depth, source_node, target_node, exclusion_list = None, inbound_check = False, targeted_check = False, task_group = None) -> None:
+    controller = N4LController().get_instance()
+    task = Neo4jConnector.start_query_task("acl", controller.retrieve_query_timeout("acl"), task_group)
+
     try:
         acl_graph = ACLGraph()
         acl_list = retrieve_acl_list(acls)
+        composite_filter = retrieve_composite_filter(acl_list, acls)
 
         root_node = name
 
@@ -455,12 +468,12 @@ def check_acls(name, acls, depth, source_node, target_node, exclusion_list = Non
             else:
                 depth = int(depth)
 
-            retrieve_acls_by_depth(acl_graph, name, name, acl_list, depth, 1, exclusion_list)
+            retrieve_acls_by_depth(acl_graph, task, name, name, acl_list, composite_filter, depth, 1, exclusion_list)
         elif inbound_search :
-            retrieve_inbound_acls(acl_graph, name, name, acl_list, exclusion_list)
+            retrieve_inbound_acls(acl_graph, task, name, name, acl_list, composite_filter, exclusion_list)
         elif targeted_search :
             root_node = source_node
-            retrieve_acls_by_target(acl_graph, source_node, target_node, acl_list, exclusion_list)
+            retrieve_acls_by_target(acl_graph, task, source_node, target_node, acl_list, composite_filter, exclusion_list)
 
 
         if len(acl_graph.graph) != 0 :
@@ -470,8 +483,11 @@ def check_acls(name, acls, depth, source_node, target_node, exclusion_list = Non
 
             draw_acl_graph(acl_graph.graph, root_node, inbound_check)
         else:
-            controller = N4LController().get_instance()
             controller.notify_no_results("ACL Finder didn't return any result")
-    except:
-        controller = N4LController().get_instance()
-        controller.notify_error(traceback.format_exc())
\ No newline at end of file
+    except Exception as error:
+        if task.is_interrupted(error) :
+            task.notify_interruption(error)
+        else:
+            controller.notify_error(traceback.format_exc())
+    finally:
+        Neo4jConnector.end_query_task(task)
\ No newline at end of file
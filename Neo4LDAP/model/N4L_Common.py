@@ -1,10 +1,143 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Query
+from neo4j.exceptions import Neo4jError
 
 import traceback
+import threading
+import uuid
+
+# Relationships derived by Neo4LDAP itself, they are not ACEs
+INTERNAL_RELATIONSHIP_TYPES = ["EffectiveMemberOf"]
+
+# userAccountControl flags, decomposed on ingest into uac_<flag> boolean properties
+USER_ACCOUNT_CONTROL_FLAGS = {
+    0x00000001: "script",
+    0x00000002: "accountdisable",
+    0x00000008: "homedir_required",
+    0x00000010: "lockout",
+    0x00000020: "passwd_notreqd",
+    0x00000040: "passwd_cant_change",
+    0x00000080: "encrypted_text_pwd_allowed",
+    0x00000100: "temp_duplicate_account",
+    0x00000200: "normal_account",
+    0x00000800: "interdomain_trust_account",
+    0x00001000: "workstation_trust_account",
+    0x00002000: "server_trust_account",
+    0x00010000: "dont_expire_password",
+    0x00020000: "mns_logon_account",
+    0x00040000: "smartcard_required",
+    0x00080000: "trusted_for_delegation",
+    0x00100000: "not_delegated",
+    0x00200000: "use_des_key_only",
+    0x00400000: "dont_req_preauth",
+    0x00800000: "password_expired",
+    0x01000000: "trusted_to_auth_for_delegation",
+    0x04000000: "partial_secrets_account"
+}
+
+# Flags used on AS-REP, delegation and disabled account sweeps
+INDEXED_USER_ACCOUNT_CONTROL_FLAGS = [
+    "accountdisable", "passwd_notreqd", "dont_expire_password", "trusted_for_delegation",
+    "not_delegated", "use_des_key_only", "dont_req_preauth", "trusted_to_auth_for_delegation"
+]
+
+# Labels with a range index on name
+NAME_INDEXED_LABELS = ["User", "Computer", "Group", "GPO", "Container", "OU"]
+
+def retrieve_name_indexes() -> list:
+    name_indexes = []
+    for label in NAME_INDEXED_LABELS:
+        name_indexes.append(("{label}_name_index".format(label = label.lower()), label, "name"))
+
+    return name_indexes
+
+def retrieve_uac_indexes() -> list:
+    uac_indexes = []
+    for label in ["User", "Computer"]:
+        for flag in INDEXED_USER_ACCOUNT_CONTROL_FLAGS:
+            uac_indexes.append(("{label}_uac_{flag}_index".format(label = label.lower(), flag = flag), label, "uac_" + flag))
+
+    return uac_indexes
+
+# Upper-cased copy of samaccountname written on ingest, collectors don't agree on its case.
+# Indexed on Base so samaccountname lists are seeked without an objectClass
+NORMALIZED_SAMACCOUNTNAME = "samaccountname_upper"
+
+def retrieve_samaccountname_indexes() -> list:
+    return [("base_samaccountname_upper_index", "Base", NORMALIZED_SAMACCOUNTNAME)]
+
+# label -> indexed properties online in the current database, used by the LDAP compiler to pick an anchor.
+# Databases ingested by older versions or cleared since lack some of the indexes created on ingest
+def retrieve_indexed_properties() -> dict:
+    return Neo4jConnector.retrieve_schema_catalog()["NodeIndexes"]
+
+class QueryCancelledError(Exception):
+    pass
+
+# Queries run on behalf of one GUI request, tagged with the task id in the transaction metadata
+# so they can be terminated server-side, timeout in seconds (0 disables it)
+class QueryTask:
+    def __init__(self, query_type, timeout):
+        self.task_id = uuid.uuid4().hex
+        self.query_type = query_type
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+
+    def create_query(self, text) -> Query:
+        timeout = self.timeout if self.timeout > 0 else None
+        return Query(text, metadata = {"n4l_task": self.task_id}, timeout = timeout)
+
+    # Records are no longer pulled once the task is cancelled, closing the session resets the transaction
+    def track(self, records) -> object:
+        for record in records:
+            if self.cancelled.is_set() :
+                raise QueryCancelledError()
+            yield record
+
+    def is_timeout(self, error) -> bool:
+        return isinstance(error, Neo4jError) and "TimedOut" in str(error.code)
+
+    # Cancellations (client or server-side) and timeouts are expected, not errors
+    def is_interrupted(self, error) -> bool:
+        return self.cancelled.is_set() or isinstance(error, QueryCancelledError) or self.is_timeout(error)
+
+    def notify_interruption(self, error) -> None:
+        from Neo4LDAP.controllers.N4L_Controller import N4LController
+
+        controller = N4LController().get_instance()
+        if self.is_timeout(error) :
+            controller.push_debug_info("[!] Query stopped after the {timeout}s {query_type} timeout".format(timeout = self.timeout, query_type = self.query_type))
+            controller.notify_no_results("The query exceeded the {timeout}s timeout configured for {query_type} queries".format(timeout = self.timeout, query_type = self.query_type))
+        else:
+            controller.push_debug_info("[!] Query cancelled")
+
+# Query tasks started for one GUI request, the Cancel button of its popup only stops these
+class QueryTaskGroup:
+    def __init__(self):
+        self.tasks = []
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def add(self, task) -> None:
+        with self.lock:
+            self.tasks.append(task)
+            if self.cancelled :
+                task.cancelled.set()
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled = True
+            tasks = list(self.tasks)
+
+        Neo4jConnector.cancel_query_tasks(tasks)
 
 class Neo4jConnector:
     driver = None
     database = "neo4j"
+    schema_catalog = {}
+    # Bumped on every refresh, compiled queries depend on the indexes of the catalog
+    schema_version = 0
+    running_tasks = {}
+    running_tasks_lock = threading.Lock()
 
     @staticmethod
     def connect_to_neo4j(username, password, database, uri) -> object:
@@ -13,33 +146,116 @@ class Neo4jConnector:
             Neo4jConnector.driver = GraphDatabase.driver(uri, auth=(username, password), encrypted=False)
             with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
                 session.run("MATCH (n) RETURN n LIMIT 1")
+
+            Neo4jConnector.schema_catalog = {}
+            Neo4jConnector.refresh_schema_catalog()
         except:
             from Neo4LDAP.controllers.N4L_Controller import N4LController
 
             controller = N4LController().get_instance()
             controller.notify_error(traceback.format_exc())
 
+    # -- QUERY TASKS --
     @staticmethod
-    def retrieve_neo4j_stats() -> dict:
+    def start_query_task(query_type, timeout, task_group = None) -> QueryTask:
+        task = QueryTask(query_type, timeout)
+        with Neo4jConnector.running_tasks_lock:
+            Neo4jConnector.running_tasks[task.task_id] = task
+
+        if task_group != None :
+            task_group.add(task)
+
+        return task
+
+    @staticmethod
+    def end_query_task(task) -> None:
+        with Neo4jConnector.running_tasks_lock:
+            Neo4jConnector.running_tasks.pop(task.task_id, None)
+
+    # Stops the streams on the client and terminates the tagged transactions of the given tasks still running on the server
+    @staticmethod
+    def cancel_query_tasks(tasks) -> None:
+        if not tasks :
+            return
+
+        for task in tasks:
+            task.cancelled.set()
+
+        try:
+            with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+                transaction_ids = session.run("""
+                SHOW TRANSACTIONS YIELD transactionId, metaData
+                WHERE metaData.n4l_task IN $task_ids
+                RETURN collect(transactionId) AS transaction_ids
+                """, task_ids = [task.task_id for task in tasks]).single()["transaction_ids"]
+
+                if transaction_ids :
+                    session.run("TERMINATE TRANSACTIONS $transaction_ids", transaction_ids = transaction_ids).consume()
+        except:
+            from Neo4LDAP.controllers.N4L_Controller import N4LController
+
+            controller = N4LController().get_instance()
+            controller.notify_error(traceback.format_exc())
+
+    # Schema catalog (relationship types, labels and property keys) cached per database,
+    # it is only refreshed after login, ingestion or a clear of the database
+    @staticmethod
+    def retrieve_schema_catalog() -> dict:
+        if Neo4jConnector.database not in Neo4jConnector.schema_catalog :
+            Neo4jConnector.refresh_schema_catalog()
+
+        return Neo4jConnector.schema_catalog[Neo4jConnector.database]
+
+    @staticmethod
+    def refresh_schema_catalog() -> dict:
         with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
-            neo4j_stats = {}
+            schema_catalog = {}
 
-            # ACL types
             result = session.run("CALL db.relationshipTypes()")
+            schema_catalog["RelationshipTypes"] = sorted([record["relationshipType"] for record in result])
+            schema_catalog["ACLTypes"] = [acl for acl in schema_catalog["RelationshipTypes"] if acl not in INTERNAL_RELATIONSHIP_TYPES]
+
+            result = session.run("CALL db.labels()")
+            schema_catalog["Labels"] = sorted([record["label"] for record in result])
 
-            acl_types = []
+            result = session.run("CALL db.propertyKeys()")
+            schema_catalog["PropertyKeys"] = sorted([record["propertyKey"] for record in result])
+
+            # Single property range indexes (BTREE before Neo4j 5) are the ones USING INDEX hints can rely on
+            result = session.run("""
+            SHOW INDEXES YIELD labelsOrTypes, properties, entityType, type, state
+            WHERE entityType = 'NODE' AND type IN ['RANGE', 'BTREE'] AND state = 'ONLINE' AND size(properties) = 1
+            RETURN labelsOrTypes, properties
+            """)
+            schema_catalog["NodeIndexes"] = {}
             for record in result:
-                acl_types.append(record["relationshipType"])
+                for label in record["labelsOrTypes"]:
+                    schema_catalog["NodeIndexes"].setdefault(label, set()).add(record["properties"][0])
+
+        Neo4jConnector.schema_catalog[Neo4jConnector.database] = schema_catalog
+        Neo4jConnector.schema_version += 1
+        return schema_catalog
 
-            neo4j_stats["ACL_Types"] = sorted(acl_types)
+    @staticmethod
+    def retrieve_neo4j_stats() -> dict:
+        schema_catalog = Neo4jConnector.retrieve_schema_catalog()
+
+        with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+            neo4j_stats = {}
+
+            # ACL types
+            neo4j_stats["ACL_Types"] = schema_catalog["ACLTypes"]
 
             # ACLs and relationships
             neo4j_stats["Relationships"] = session.run("MATCH ()-[r]->() RETURN count(r) AS rel_count").single()["rel_count"]
+            for internal_type in INTERNAL_RELATIONSHIP_TYPES:
+                if internal_type in schema_catalog["RelationshipTypes"] :
+                    neo4j_stats["Relationships"] -= session.run(f"MATCH ()-[r:{internal_type}]->() RETURN count(r) AS rel_count").single()["rel_count"]
             neo4j_stats["ACLs"] = session.run("""
             MATCH ()-[r]->() 
-            WHERE type(r) IN {acls}  
+            WHERE type(r) IN $acls
             RETURN count(r) as acl_count;
-            """.format(acls = neo4j_stats["ACL_Types"])).single()["acl_count"]
+            """, acls = neo4j_stats["ACL_Types"]).single()["acl_count"]
 
             for on_premise_item in ["User", "Group", "Computer", "OU", "GPO", "Domain"]:
                 count = session.run(f"MATCH (n:{on_premise_item}) RETURN count(n) AS count").single()["count"]
@@ -64,8 +280,13 @@ class Neo4jConnector:
             "DROP CONSTRAINT ou_objectid_constraint IF EXISTS"
         ]
 
+        for index_name, _, _ in retrieve_uac_indexes() + retrieve_samaccountname_indexes():
+            queries.append(f"DROP INDEX {index_name} IF EXISTS")
+
         with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
             for query in queries:
                 session.run(query)
 
             session.run("MATCH (n) DETACH DELETE n")
+
+        Neo4jConnector.refresh_schema_catalog()
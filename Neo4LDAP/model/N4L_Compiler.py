@@ -0,0 +1,564 @@
+from Neo4LDAP.model.N4L_Common import *
+from Neo4LDAP.model.N4L_Filter import AndFilter, OrFilter, NotFilter, ComparisonFilter, PresenceFilter, SubstringFilter, ExtensibleFilter, InListFilter
+
+import re
+
+LDAP_MATCHING_RULE_BIT_AND = "1.2.840.113556.1.4.803"
+LDAP_MATCHING_RULE_BIT_OR = "1.2.840.113556.1.4.804"
+LDAP_MATCHING_RULE_IN_CHAIN = "1.2.840.113556.1.4.1941"
+
+# objectClass values that don't match their label name
+OBJECT_CLASS_LABELS = {
+    "organizationalunit": "OU",
+    "ou": "OU",
+    "grouppolicycontainer": "GPO",
+    "gpo": "GPO"
+}
+
+# Parent nodes used on (ou=...), (gpo=...) and (container=...)
+PARENT_RELATIONSHIPS = {
+    "ou": ("OU", "Contains"),
+    "gpo": ("GPO", "GPLink"),
+    "container": ("Container", "Contains")
+}
+
+# Per-node pattern comprehensions, linear in the membership edges of each node
+MEMBEROF_PROJECTION = "[(n)-[:MemberOf]->(g:Group) | g.name]"
+MEMBER_PROJECTION = "[(n)<-[:MemberOf]-(member) | member.name]"
+
+# Smallest node sets first, used to anchor on a label when no index can be used
+LABEL_SELECTIVITY = ["Domain", "GPO", "OU", "Container", "Computer", "Group", "User"]
+
+# Timestamps shown as dates
+DATE_ATTRIBUTES = ["whencreated", "lastlogontimestamp", "pwdlastset"]
+
+# LDAP attributes seeked on an upper-cased text property, when it's indexed
+SEEKABLE_TEXT_PROPERTIES = {
+    "cn": "name",
+    "name": "name",
+    "samaccountname": NORMALIZED_SAMACCOUNTNAME
+}
+
+REGEX_SPECIAL_CHARS = set("\\^$.|?*+()[]{}")
+NUMERIC_VALUE = re.compile(r"^-?\d+$")
+
+# Bitwise matching rules work on the unsigned 32-bit value, negative masks (e.g. groupType) keep their sign bit
+def parse_bitwise_mask(filter_node) -> int:
+    value = filter_node.value.strip()
+    if not NUMERIC_VALUE.match(value) :
+        raise ValueError("'{value}' is not a valid bitmask in LDAP filter item '{item}'".format(value = value, item = str(filter_node)))
+
+    return int(value) & 0xFFFFFFFF
+
+#Some LDAP keys doesn't exist in cypher so we need to adapt them
+def adapt_attribute_to_cypher(member_key) -> str:
+    member_key = member_key.lower()
+
+    if member_key == "cn" :
+        cypher_key = "n.name"
+    elif member_key == "memberof" :
+        cypher_key = MEMBEROF_PROJECTION + " AS memberof"
+    elif member_key == "member" :
+        cypher_key = MEMBER_PROJECTION + " AS member"
+    elif member_key == "serviceprincipalnames" :
+        cypher_key = "coalesce(n.serviceprincipalnames, []) AS serviceprincipalnames"
+    else:
+        cypher_key = adapt_property_to_cypher("n", member_key)
+
+    return cypher_key
+
+# Record key, shown key and kind (membership, spn, date or value) of every returned attribute,
+# resolved once per query so records don't parse Cypher keys
+def compile_result_columns(attribute_list) -> list:
+    result_columns = []
+    for attribute in attribute_list:
+        attribute = attribute.lower()
+
+        if attribute == "memberof" :
+            result_columns.append(("memberof", "memberOf", "membership"))
+        elif attribute == "member" :
+            result_columns.append(("member", "member", "membership"))
+        elif attribute == "serviceprincipalnames" :
+            result_columns.append(("serviceprincipalnames", "serviceprincipalnames", "spn"))
+        else:
+            record_key = adapt_attribute_to_cypher(attribute)
+            column_kind = "date" if attribute in DATE_ATTRIBUTES else "value"
+            result_columns.append((record_key, record_key.split(".", 1)[1].strip("`"), column_kind))
+
+    return result_columns
+
+def adapt_property_to_cypher(variable, property_name) -> str:
+    if re.match(r"^[a-z_][a-z0-9_]*$", property_name) :
+        return "{variable}.{key}".format(variable=variable, key=property_name)
+    else:
+        return "{variable}.`{key}`".format(variable=variable, key=property_name.replace("`", "``"))
+
+def escape_regex_value(value) -> str:
+    escaped_value = []
+    for char in value:
+        if char in REGEX_SPECIAL_CHARS :
+            escaped_value.append("\\" + char)
+        else:
+            escaped_value.append(char)
+
+    return "".join(escaped_value)
+
+class CypherCompiler:
+    def __init__(self):
+        self.variable_count = 0
+        self.parameters = {}
+
+    # Literal values are sent as $parameters so the query text only depends on the filter shape
+    def literal(self, value) -> str:
+        parameter_name = "value{index}".format(index = len(self.parameters))
+        self.parameters[parameter_name] = value
+
+        return "$" + parameter_name
+
+    def next_variable(self, prefix) -> str:
+        variable = "{prefix}{index}".format(prefix=prefix, index=self.variable_count)
+        self.variable_count += 1
+        return variable
+
+    # -- REWRITE --
+    # Equalities that can be merged into a single IN $values predicate
+    def is_collapsible_equality(self, filter_node) -> bool:
+        if not isinstance(filter_node, ComparisonFilter) or filter_node.operator != "=" :
+            return False
+        if filter_node.attribute == "objectclass" :
+            return False
+
+        value = filter_node.value.strip().upper()
+        if value in ("TRUE", "FALSE") or NUMERIC_VALUE.match(value) :
+            return False
+
+        # Distinguished names are matched against another property
+        if filter_node.attribute in ("memberof", "member") or filter_node.attribute in PARENT_RELATIONSHIPS :
+            return not value.startswith("CN=")
+
+        return True
+
+    # (|(attr=a)(attr=b)...) -> attr IN [a, b, ...]
+    def collapse_disjunctions(self, filter_node) -> object:
+        if isinstance(filter_node, AndFilter) :
+            return AndFilter([self.collapse_disjunctions(child) for child in filter_node.children])
+        elif isinstance(filter_node, NotFilter) :
+            return NotFilter(self.collapse_disjunctions(filter_node.child))
+        elif not isinstance(filter_node, OrFilter) :
+            return filter_node
+
+        values_by_attribute = {}
+        for child in filter_node.children:
+            if self.is_collapsible_equality(child) :
+                values_by_attribute.setdefault(child.attribute, []).append(child.value.strip().upper())
+
+        children = []
+        collapsed_attributes = set()
+        for child in filter_node.children:
+            if self.is_collapsible_equality(child) and len(values_by_attribute[child.attribute]) > 1 :
+                if child.attribute not in collapsed_attributes :
+                    collapsed_attributes.add(child.attribute)
+                    children.append(InListFilter(child.attribute, list(dict.fromkeys(values_by_attribute[child.attribute]))))
+            else:
+                children.append(self.collapse_disjunctions(child))
+
+        if len(children) == 1 :
+            return children[0]
+
+        return OrFilter(children)
+
+    # -- WHERE --
+    def compile_filter(self, filter_node) -> str:
+        if isinstance(filter_node, AndFilter) :
+            if not filter_node.children :
+                return "true"
+            return "( " + " AND ".join(self.compile_filter(child) for child in filter_node.children) + " )"
+        elif isinstance(filter_node, OrFilter) :
+            if not filter_node.children :
+                return "false"
+            return "( " + " OR ".join(self.compile_filter(child) for child in filter_node.children) + " )"
+        elif isinstance(filter_node, NotFilter) :
+            return "NOT ( " + self.compile_filter(filter_node.child) + " )"
+        elif isinstance(filter_node, ExtensibleFilter) :
+            return self.compile_extensible(filter_node)
+        else:
+            return self.compile_item(filter_node)
+
+    def compile_item(self, filter_node) -> str:
+        attribute = filter_node.attribute
+
+        if attribute == "objectclass" :
+            return self.compile_object_class(filter_node)
+        elif attribute == "memberof" :
+            return self.compile_membership(filter_node, "(n)-[:MemberOf]->({variable}:Group)", "name")
+        elif attribute == "member" :
+            return self.compile_membership(filter_node, "(n)<-[:MemberOf]-({variable})", "samaccountname")
+        elif attribute in PARENT_RELATIONSHIPS :
+            label, relationship = PARENT_RELATIONSHIPS[attribute]
+            return self.compile_membership(filter_node, "({variable}:" + label + ")-[:" + relationship + "]->(n)", "name")
+        elif attribute == "serviceprincipalnames" :
+            if isinstance(filter_node, PresenceFilter) :
+                return "size(coalesce(n.serviceprincipalnames, [])) > 0"
+
+            return "ANY (spn IN n.serviceprincipalnames WHERE {predicate})".format(predicate = self.compile_value_predicate("toUpper(spn)", "spn", filter_node))
+        elif attribute == "cn" :
+            return self.compile_property(filter_node, "n", "name")
+        else:
+            return self.compile_property(filter_node, "n", attribute)
+
+    def compile_object_class(self, filter_node) -> str:
+        # (objectClass=*) -> every AD principal
+        if isinstance(filter_node, PresenceFilter) :
+            return "n.samaccountname IS NOT NULL"
+
+        if isinstance(filter_node, SubstringFilter) :
+            return "ANY (label IN labels(n) WHERE {predicate})".format(predicate = self.compile_value_predicate("toUpper(label)", "label", filter_node))
+
+        return "n:" + self.retrieve_object_class_label(filter_node.value)
+
+    def retrieve_object_class_label(self, object_class) -> str:
+        object_class = object_class.strip()
+        label = OBJECT_CLASS_LABELS.get(object_class.lower(), object_class[:1].upper() + object_class[1:].lower())
+
+        if not re.match(r"^[A-Za-z][A-Za-z0-9_]*$", label) :
+            raise ValueError("'{object_class}' is not a valid objectClass".format(object_class = object_class))
+
+        return label
+
+    def compile_membership(self, filter_node, pattern, property_name) -> str:
+        variable = self.next_variable("g")
+
+        # Distinguished names are matched against distinguishedname instead of the name
+        if isinstance(filter_node, ComparisonFilter) and filter_node.value.strip().upper().startswith("CN=") :
+            property_name = "distinguishedname"
+
+        return "EXISTS {{\n\tMATCH {pattern}\n\tWHERE {predicate}\n}}".format(pattern = pattern.format(variable = variable), predicate = self.compile_property(filter_node, variable, property_name))
+
+    def compile_property(self, filter_node, variable, property_name) -> str:
+        cypher_key = adapt_property_to_cypher(variable, property_name)
+
+        if isinstance(filter_node, PresenceFilter) :
+            return "{key} IS NOT NULL".format(key = cypher_key)
+
+        if isinstance(filter_node, InListFilter) :
+            return "toUpper({key}) IN {values}".format(key = cypher_key, values = self.literal(filter_node.values))
+
+        if isinstance(filter_node, ComparisonFilter) :
+            value = filter_node.value.strip()
+
+            if value.upper() in ("TRUE", "FALSE") and filter_node.operator == "=" :
+                return "{key} = {value}".format(key = cypher_key, value = self.literal(value.upper() == "TRUE"))
+
+            if NUMERIC_VALUE.match(value) :
+                if filter_node.operator in (">=", "<=", ">", "<") :
+                    return "{key} {operator} {value}".format(key = cypher_key, operator = filter_node.operator, value = self.literal(int(value)))
+
+                return "toString({key}) = {value}".format(key = cypher_key, value = self.literal(value))
+
+        return self.compile_value_predicate("toUpper({key})".format(key = cypher_key), cypher_key, filter_node)
+
+    def compile_value_predicate(self, cypher_key, raw_key, filter_node) -> str:
+        if isinstance(filter_node, PresenceFilter) :
+            return "{key} IS NOT NULL".format(key = raw_key)
+
+        if isinstance(filter_node, InListFilter) :
+            return "{key} IN {values}".format(key = cypher_key, values = self.literal(filter_node.values))
+
+        if isinstance(filter_node, SubstringFilter) :
+            initial = filter_node.initial.strip().upper()
+            final = filter_node.final.strip().upper()
+            any_parts = [part.upper() for part in filter_node.any_parts]
+
+            if not any_parts :
+                if initial and final :
+                    return "{key} STARTS WITH {initial} AND {key} ENDS WITH {final}".format(key = cypher_key, initial = self.literal(initial), final = self.literal(final))
+                elif initial :
+                    return "{key} STARTS WITH {value}".format(key = cypher_key, value = self.literal(initial))
+                elif final :
+                    return "{key} ENDS WITH {value}".format(key = cypher_key, value = self.literal(final))
+                else:
+                    return "{key} IS NOT NULL".format(key = raw_key)
+            elif not initial and not final and len(any_parts) == 1 :
+                return "{key} CONTAINS {value}".format(key = cypher_key, value = self.literal(any_parts[0]))
+            else:
+                regex = "(?s)" + escape_regex_value(initial) + ".*" + ".*".join(escape_regex_value(part) for part in any_parts) + ".*" + escape_regex_value(final)
+                return "{key} =~ {value}".format(key = cypher_key, value = self.literal(regex))
+
+        operator = filter_node.operator
+        if operator == "~=" :
+            operator = "="
+
+        return "{key} {operator} {value}".format(key = cypher_key, operator = operator, value = self.literal(filter_node.value.strip().upper()))
+
+    # Databases ingested before the closure was computed have memberships but no EffectiveMemberOf,
+    # the in-chain rule would silently match nothing on them
+    def check_membership_closure(self, filter_node) -> None:
+        relationship_types = Neo4jConnector.retrieve_schema_catalog()["RelationshipTypes"]
+        if "MemberOf" in relationship_types and "EffectiveMemberOf" not in relationship_types :
+            raise ValueError("LDAP filter item '{item}' needs the nested membership closure, re-ingest the data to build it".format(item = str(filter_node)))
+
+    def compile_extensible(self, filter_node) -> str:
+        attribute = filter_node.attribute
+        matching_rule = filter_node.matching_rule
+
+        if matching_rule == LDAP_MATCHING_RULE_IN_CHAIN and attribute in ("memberof", "member") :
+            # Nested memberships are resolved with the EffectiveMemberOf closure computed on ingest
+            self.check_membership_closure(filter_node)
+            value_filter = ComparisonFilter(attribute, "=", filter_node.value)
+            if attribute == "memberof" :
+                return self.compile_membership(value_filter, "(n)-[:EffectiveMemberOf]->({variable}:Group)", "name")
+            else:
+                return self.compile_membership(value_filter, "(n)<-[:EffectiveMemberOf]-({variable})", "samaccountname")
+
+        if matching_rule in (LDAP_MATCHING_RULE_BIT_AND, LDAP_MATCHING_RULE_BIT_OR) and attribute != "" :
+            return self.compile_bitwise_match(attribute, matching_rule, parse_bitwise_mask(filter_node))
+
+        raise ValueError("Unsupported extensible match: {filter}".format(filter = str(filter_node)))
+
+    def compile_bitwise_match(self, attribute, matching_rule, mask) -> str:
+        cypher_key = adapt_property_to_cypher("n", attribute)
+
+        if mask == 0 :
+            if matching_rule == LDAP_MATCHING_RULE_BIT_AND :
+                return "{key} IS NOT NULL".format(key = cypher_key)
+            return "false"
+
+        # userAccountControl flags are decomposed into indexed boolean properties on ingest,
+        # databases ingested by older versions only have the raw value
+        property_keys = Neo4jConnector.retrieve_schema_catalog()["PropertyKeys"] if attribute == "useraccountcontrol" else []
+
+        bit_predicates = []
+        for bit in range(0, mask.bit_length()):
+            flag_value = 1 << bit
+            if not mask & flag_value :
+                continue
+
+            if flag_value in USER_ACCOUNT_CONTROL_FLAGS and "uac_" + USER_ACCOUNT_CONTROL_FLAGS[flag_value] in property_keys :
+                bit_predicates.append("n.uac_{flag} = true".format(flag = USER_ACCOUNT_CONTROL_FLAGS[flag_value]))
+            else:
+                # Two's complement for negative values (e.g. groupType)
+                bit_predicates.append("(({key} % 4294967296) + 4294967296) % {modulo} >= {flag}".format(key = cypher_key, modulo = flag_value * 2, flag = flag_value))
+
+        if matching_rule == LDAP_MATCHING_RULE_BIT_AND :
+            return "( " + " AND ".join(bit_predicates) + " )"
+        else:
+            return "( " + " OR ".join(bit_predicates) + " )"
+
+    # -- ANCHOR --
+    def retrieve_mandatory_label(self, conjunct) -> str:
+        if isinstance(conjunct, ComparisonFilter) and conjunct.attribute == "objectclass" and conjunct.operator == "=" :
+            return self.retrieve_object_class_label(conjunct.value)
+
+        return None
+
+    # Indexed property of n that can serve the conjunct and its rank (lower is more selective)
+    def retrieve_seekable_property(self, conjunct) -> tuple:
+        if isinstance(conjunct, (ComparisonFilter, InListFilter, SubstringFilter)) and conjunct.attribute in SEEKABLE_TEXT_PROPERTIES :
+            property_name = SEEKABLE_TEXT_PROPERTIES[conjunct.attribute]
+
+            if isinstance(conjunct, ComparisonFilter) and conjunct.operator == "=" :
+                value = conjunct.value.strip()
+                if value != "" and value.upper() not in ("TRUE", "FALSE") and not NUMERIC_VALUE.match(value) :
+                    return property_name, 0
+            elif isinstance(conjunct, InListFilter) :
+                return property_name, 0
+            elif isinstance(conjunct, SubstringFilter) and conjunct.initial.strip() != "" :
+                return property_name, 2
+        elif isinstance(conjunct, ExtensibleFilter) and conjunct.attribute == "useraccountcontrol" and conjunct.matching_rule == LDAP_MATCHING_RULE_BIT_AND :
+            mask = parse_bitwise_mask(conjunct)
+            if mask in USER_ACCOUNT_CONTROL_FLAGS :
+                return "uac_" + USER_ACCOUNT_CONTROL_FLAGS[mask], 4
+
+        return None, None
+
+    # memberOf conjuncts that can start from an index seek on the group, (relationship, group filter, rank)
+    def retrieve_membership_anchor(self, conjunct) -> tuple:
+        relationship = "MemberOf"
+        if isinstance(conjunct, ExtensibleFilter) and conjunct.attribute == "memberof" and conjunct.matching_rule == LDAP_MATCHING_RULE_IN_CHAIN :
+            self.check_membership_closure(conjunct)
+            relationship = "EffectiveMemberOf"
+            conjunct = ComparisonFilter(conjunct.attribute, "=", conjunct.value)
+
+        if isinstance(conjunct, ComparisonFilter) and conjunct.attribute == "memberof" and conjunct.operator == "=" :
+            value = conjunct.value.strip()
+            # Distinguished names are not indexed
+            if value != "" and not value.upper().startswith("CN=") :
+                return relationship, conjunct, 1
+        elif isinstance(conjunct, InListFilter) and conjunct.attribute == "memberof" :
+            return relationship, conjunct, 1
+        elif isinstance(conjunct, SubstringFilter) and conjunct.attribute == "memberof" and conjunct.initial.strip() != "" :
+            return relationship, conjunct, 3
+
+        return None, None, None
+
+    def compile_seekable_predicate(self, conjunct, variable, property_name) -> str:
+        if property_name not in SEEKABLE_TEXT_PROPERTIES.values() :
+            return "{variable}.{key} = true".format(variable = variable, key = property_name)
+
+        # SharpHound and BloodHound.py store name upper-cased (USER@CORP.LOCAL) and samaccountname is upper-cased
+        # on ingest, so the literal is upper-cased instead of the property and the index can serve the predicate.
+        # Only used when the index exists
+        cypher_key = "{variable}.{key}".format(variable = variable, key = property_name)
+        if isinstance(conjunct, InListFilter) :
+            return "{key} IN {values}".format(key = cypher_key, values = self.literal(conjunct.values))
+        if isinstance(conjunct, ComparisonFilter) :
+            return "{key} = {value}".format(key = cypher_key, value = self.literal(conjunct.value.strip().upper()))
+
+        predicate = "{key} STARTS WITH {value}".format(key = cypher_key, value = self.literal(conjunct.initial.strip().upper()))
+        if conjunct.any_parts or conjunct.final.strip() != "" :
+            predicate += " AND " + self.compile_value_predicate("toUpper({key})".format(key = cypher_key), cypher_key, SubstringFilter(conjunct.attribute, "", conjunct.any_parts, conjunct.final))
+
+        return predicate
+
+    # Lifts mandatory objectClass constraints into the MATCH and picks the most selective indexed anchor,
+    # either on n itself or on a group whose members are then expanded
+    def plan_anchor(self, filter_node) -> tuple:
+        conjuncts = list(filter_node.children) if isinstance(filter_node, AndFilter) else [filter_node]
+
+        labels = []
+        for conjunct in conjuncts:
+            label = self.retrieve_mandatory_label(conjunct)
+            if label != None and label not in labels :
+                labels.append(label)
+
+        def label_rank(label) -> int:
+            return LABEL_SELECTIVITY.index(label) if label in LABEL_SELECTIVITY else len(LABEL_SELECTIVITY)
+
+        indexed_properties = retrieve_indexed_properties()
+        anchor = None
+        for index, conjunct in enumerate(conjuncts):
+            relationship, group_filter, rank = self.retrieve_membership_anchor(conjunct)
+            if relationship != None :
+                candidate = (rank, 0, index, None, relationship, group_filter)
+                if anchor == None or candidate[:3] < anchor[:3] :
+                    anchor = candidate
+                continue
+
+            property_name, rank = self.retrieve_seekable_property(conjunct)
+            if property_name == None :
+                continue
+
+            # Every node is a Base, its indexes can anchor filters without an objectClass
+            for label in labels + ["Base"]:
+                if property_name in indexed_properties.get(label, ()) :
+                    candidate = (rank, label_rank(label), index, label, property_name, conjunct)
+                    if anchor == None or candidate[:3] < anchor[:3] :
+                        anchor = candidate
+
+        anchor_label = min(labels, key = label_rank) if labels else None
+        node_pattern = "(n:{label})".format(label = anchor_label) if anchor_label != None else "(n)"
+
+        seek_index = None
+        distinct = False
+        where_clauses = []
+
+        if anchor == None :
+            match_clause = "MATCH {node}\n".format(node = node_pattern)
+        elif anchor[3] == None :
+            # Who is in X: seek the group and expand its members inbound
+            _, _, seek_index, _, relationship, group_filter = anchor
+            variable = self.next_variable("g")
+
+            match_clause = "MATCH ({variable}:Group)\n".format(variable = variable)
+            if "name" in indexed_properties.get("Group", ()) :
+                match_clause += "USING INDEX {variable}:Group(name)\n".format(variable = variable)
+                match_clause += "WHERE {predicate}\n".format(predicate = self.compile_seekable_predicate(group_filter, variable, "name"))
+            else:
+                # Without the index the groups are scanned anyway, keep the case-insensitive comparison
+                match_clause += "WHERE {predicate}\n".format(predicate = self.compile_property(group_filter, variable, "name"))
+            match_clause += "MATCH ({variable})<-[:{relationship}]-{node}\n".format(variable = variable, relationship = relationship, node = node_pattern)
+
+            # A prefix can match several groups sharing members
+            distinct = True
+        else:
+            _, _, seek_index, anchor_label, index_property, seek_conjunct = anchor
+            node_pattern = "(n:{label})".format(label = anchor_label)
+
+            match_clause = "MATCH {node}\n".format(node = node_pattern)
+            match_clause += "USING INDEX n:{label}({key})\n".format(label = anchor_label, key = index_property)
+            where_clauses.append(self.compile_seekable_predicate(seek_conjunct, "n", index_property))
+
+        for index, conjunct in enumerate(conjuncts):
+            if index == seek_index :
+                continue
+            if anchor_label != None and self.retrieve_mandatory_label(conjunct) == anchor_label :
+                continue
+
+            where_clauses.append(self.compile_filter(conjunct))
+
+        return match_clause, where_clauses, distinct
+
+    # -- QUERY --
+    # Top-level OR branches compiled as independent queries, so each one can pick its own anchor
+    def compile_branch_queries(self, filter_node, attribute_list) -> list:
+        filter_node = self.collapse_disjunctions(filter_node)
+        if not isinstance(filter_node, OrFilter) or len(filter_node.children) < 2 :
+            return None
+
+        branch_queries = []
+        for child in filter_node.children:
+            compiler = CypherCompiler()
+            branch_queries.append((compiler.compile_query(child, attribute_list, False, True), compiler.parameters))
+
+        return branch_queries
+
+    # Top-level OR branches counted by the server in a single query, UNION drops the nodes matched by several
+    # branches and each branch still picks its own anchor. Branches share this compiler so parameters don't clash
+    def compile_union_count_query(self, filter_node) -> str:
+        filter_node = self.collapse_disjunctions(filter_node)
+        if not isinstance(filter_node, OrFilter) or len(filter_node.children) < 2 :
+            return None
+
+        branch_queries = [self.compile_query(child, None, True, True) for child in filter_node.children]
+        return "CALL {\n" + "\nUNION\n".join(branch_queries) + "\n}\nRETURN count(objectid) AS count"
+
+    # Branch and paged queries always return the objectid so their results can be merged or continued
+    # Paged queries expect $last_objectid (null on the first page) and $page_size
+    def compile_query(self, filter_node, attribute_list, count_only = False, branch = False, paged = False) -> str:
+        filter_node = self.collapse_disjunctions(filter_node)
+        match_clause, where_clauses, distinct = self.plan_anchor(filter_node)
+
+        if paged :
+            where_clauses.append("($last_objectid IS NULL OR n.objectid > $last_objectid)")
+
+        # 1- MATCH
+        cypher_query = match_clause
+
+        # 2- WHERE
+        if where_clauses :
+            cypher_query += "WHERE {where_clauses}\n".format(where_clauses = " AND ".join(where_clauses))
+
+        if distinct :
+            cypher_query += "WITH DISTINCT n\n"
+
+        if paged :
+            cypher_query += "WITH n ORDER BY n.objectid LIMIT $page_size\n"
+
+        # Count-only queries never leave the matched nodes
+        if count_only :
+            if branch :
+                return cypher_query + "RETURN n.objectid AS objectid"
+            return cypher_query + "RETURN count(n) AS count"
+
+        # 3- WITH
+        if attribute_list == None :
+            cypher_query += "WITH n, {memberof} AS memberof, {member} AS member\n".format(memberof = MEMBEROF_PROJECTION, member = MEMBER_PROJECTION)
+
+        # 4- RETURN
+        # Memberships are only expanded when requested, otherwise only n properties are read
+        if attribute_list :
+            attributes = ", ".join(adapt_attribute_to_cypher(attribute) for attribute in attribute_list)
+            if branch or paged :
+                attributes += ", n.objectid AS objectid"
+            cypher_query += "RETURN DISTINCT {attributes}".format(attributes = attributes)
+
+            if paged :
+                cypher_query += " ORDER BY objectid"
+        else:
+            # Each matched node is a single row already, no DISTINCT needed
+            cypher_query += "RETURN n, memberof, member"
+
+            if paged :
+                cypher_query += " ORDER BY n.objectid"
+
+        return cypher_query
@@ -1,415 +1,305 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timedelta
 
 from Neo4LDAP.model.N4L_Common import *
+from Neo4LDAP.model.N4L_Filter import parse_ldap_filter, build_values_filter
+from Neo4LDAP.model.N4L_Compiler import CypherCompiler, DATE_ATTRIBUTES, compile_result_columns
+from Neo4LDAP.model.N4L_Plan import *
+from Neo4LDAP.model.N4L_Parser import load_side_store_properties, retrieve_side_store_path
 from Neo4LDAP.controllers.N4L_Controller import N4LController
 
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
+import time
+import json
+import csv
+import os
 import re
 
-def parse_timestamp(timestamp) -> datetime:
-    try:
-        time_value = str(timestamp).strip()
-        return_format = '%d-%m-%Y %H:%M:%S'
+COMPILED_QUERY_CACHE_SIZE = 128
+OR_BRANCH_WORKERS = 8
+# Records buffered between the OR branches and the merge
+BRANCH_QUEUE_SIZE = 1000
+BRANCH_DONE = object()
+RESULT_CHUNK_SIZE = 200
+
+# Blank rows between records in the result table
+RECORD_SEPARATOR_ROWS = [("", ""), ("", "")]
+
+# data/N4L_query_settings.json, page_size 0 disables paging
+# Transaction timeouts per query type in seconds, 0 disables them
+# plan_mode is off, explain or profile, slow query thresholds of 0 disable them
+DEFAULT_QUERY_SETTINGS = {
+    "page_size": 500,
+    "ldap_timeout": 300,
+    "count_timeout": 120,
+    "acl_timeout": 600,
+    "export_timeout": 0,
+    "batch_workers": 4,
+    "plan_mode": PLAN_MODE_OFF,
+    "slow_query_threshold_ms": 2000,
+    "slow_query_db_hits_threshold": 1000000
+}
+
+# -- TIMESTAMPS --
+TIMESTAMP_FORMAT = "%d-%m-%Y %H:%M:%S"
+TIMESTAMP_CACHE_SIZE = 4096
+
+EPOCH_DATE = datetime(1970, 1, 1)
+# Windows FILETIME -> 100ns intervals since Jan 1, 1601
+FILETIME_THRESHOLD = 100000000000000000
+FILETIME_EPOCH_SECONDS = 11644473600
+
+# Only the date part goes through datetime, once per day
+@lru_cache(maxsize = TIMESTAMP_CACHE_SIZE)
+def format_epoch_day(day) -> str:
+    return (EPOCH_DATE + timedelta(days = day)).strftime("%d-%m-%Y")
+
+# Sentinels such as 0 or -1 and repeated values are resolved once
+@lru_cache(maxsize = TIMESTAMP_CACHE_SIZE)
+def format_integer_timestamp(time_value_int) -> str:
+    if time_value_int > FILETIME_THRESHOLD :
+        seconds = time_value_int // 10000000 - FILETIME_EPOCH_SECONDS
+    else:
+        seconds = time_value_int
+
+    day, day_seconds = divmod(seconds, 86400)
+    hours, remainder = divmod(day_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    return "{date} {hours:02d}:{minutes:02d}:{seconds:02d}".format(date = format_epoch_day(day), hours = hours, minutes = minutes, seconds = seconds)
 
+@lru_cache(maxsize = TIMESTAMP_CACHE_SIZE)
+def parse_timestamp_text(time_value) -> str:
+    try:
         # GeneralizedTime -> YYYYMMDDHHMMSS(.0)Z
         if time_value.endswith("Z") and len(time_value) >= 15 :
             try:
-                return datetime.strptime(time_value, "%Y%m%d%H%M%S.%fZ").strftime(return_format)
+                return datetime.strptime(time_value, "%Y%m%d%H%M%S.%fZ").strftime(TIMESTAMP_FORMAT)
             except ValueError:
-                return datetime.strptime(time_value, "%Y%m%d%H%M%SZ").strftime(return_format)
-
-        # Windows FILETIME -> 100ns intervals since Jan 1, 1601
-        time_value_int = int(float(time_value))
-        if time_value_int > 100000000000000000:
-            if time_value_int == 0:
-                return "Never"
-            date = datetime(1601, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=time_value_int // 10)
-            return date.strftime(return_format)
-
-        # Unix timestamp (epoch)
-        date = datetime.fromtimestamp(time_value_int, tz=timezone.utc)
-        return date.strftime(return_format)
+                return datetime.strptime(time_value, "%Y%m%d%H%M%SZ").strftime(TIMESTAMP_FORMAT)
+
+        return format_integer_timestamp(int(float(time_value)))
     except Exception:
         return "Invalid timestamp"
 
-#Some LDAP keys doesn't exist in cypher so we need to adapt them
-def adapt_ldap_item_to_cypher(member_key, member_value) -> tuple:
-    member_value = member_value.upper().strip()
-    member_key = member_key.lower().strip()
-
-    if member_key == "cn" :
-        cypher_key = "toUpper(n.name)"
-    elif member_key == "objectclass" :
-        if member_value == "*" :
-            cypher_key = "n.samaccountname"
-        elif member_value == "ORGANIZATIONALUNIT" :
-            cypher_key = "ou.name"
-            member_value = "*"
-        elif member_value == "GROUPPOLICYCONTAINER" :
-            cypher_key = "gpo.name"
-            member_value = "*"
-        elif member_value == "CONTAINER" :
-            cypher_key = "container.name"
-            member_value = "*"
-        else:
-            cypher_key = "n:" + member_value[0] + member_value[1:].lower()
-            member_value = ""
-    elif member_key == "memberof" :
-        cypher_key = "toUpper(gC.name)"
-    elif member_key == "member" :
-        cypher_key = "toUpper(memberC.samaccountname)" 
-    elif member_key == "serviceprincipalnames" :
-        cypher_key = "ANY (spn IN n.serviceprincipalnames WHERE toUpper(spn)"
-    elif member_key == "ou" :
-        cypher_key = "toUpper(ou.name)"
-    elif member_key == "gpo" :
-        cypher_key = "toUpper(gpo.name)"
-    elif member_key == "container" :
-        cypher_key = "toUpper(container.name)"
-    else:
-        if("-" in member_key):
-            cypher_key = "toUpper(n.`{key}`)".format(key=member_key)
-        else:
-            cypher_key = "toUpper(n.{key})".format(key=member_key)
-
-    if member_value == "TRUE" or member_value == "FALSE" :
-        cypher_key = "n.{key}".format(key=member_key)
-        member_value = member_value[0] + member_value[1:].lower()
-
-    return cypher_key, member_value
-
-def adapt_attribute_to_cypher(member_key) -> str:
-    member_key = member_key.lower()
-
-    if member_key == "cn" :
-        cypher_key = "n.name"
-    elif member_key == "memberof" :
-        cypher_key = "collect('memberOf: ' + g.name) AS memberof"
-    elif member_key == "member" :
-        cypher_key = "collect('member : ' + member.name) as member"
-    elif member_key == "serviceprincipalnames" :
-        cypher_key = "collect('serviceprincipalnames : ' + n.serviceprincipalnames) as serviceprincipalnames"
-    else:
-        if("-" in member_key):
-            cypher_key = "n.`{key}`".format(key=member_key)
-        else:    
-            cypher_key = "n.{key}".format(key=member_key)
-    
-    return cypher_key
-    
-def compute_comparation(member_key, comparator, member_value) -> tuple:
-    if "n:" in member_key : # n:Group, n:Computer...
-        return "",""
-    else:
-        if "*" in member_value : 
-            member_value_raw = member_value.strip("'")
-            cypher_comparator, cypher_value = "", ""
-
-            if member_value_raw[0] == "*" and member_value_raw[-1] == "*" :
-                cypher_comparator = " CONTAINS "
-                cypher_value = "'{value}'".format(value=member_value_raw[1:-1])
-            elif member_value_raw[0] != "*" and member_value_raw[-1] == "*" :
-                cypher_comparator = " STARTS WITH " 
-                cypher_value = "'{value}'".format(value=member_value_raw[0:-1])
-            elif member_value_raw[0] == "*" and member_value_raw[-1] != "*" :
-                cypher_comparator = " ENDS WITH "
-                cypher_value = "'{value}'".format(value=member_value_raw[1:])
-            
-            return cypher_comparator, cypher_value
-        if member_key == "gC.name" :
-            return " STARTS WITH ", "'{value}'".format(value=member_value_raw)
-        
-        return " {comparator} ".format(comparator = comparator), member_value
-
-def tokenize_ldap_to_cypher(tokenized_operator, tokenized_items) -> str:
-    if tokenized_operator == None :
-        itemList = re.split(r"(<=|>=|=|>|<)", tokenized_items[0])
-
-        token_key, token_value = adapt_ldap_item_to_cypher(itemList[0], itemList[2])
-
-        if token_value != "True" and token_value != "False" :
-            token_value = "'{value}'".format(value=token_value)
-
-        comparation, token_value = compute_comparation(token_key, itemList[1], token_value)
-
-        if "n.serviceprincipalnames" in token_key :
-            return "{key}{comparation}{value})".format(key=token_key, comparation=comparation, value=token_value)
-        else:
-            return "{key}{comparation}{value}".format(key=token_key, comparation=comparation, value=token_value)
-    else:
-        expressions = []
-
-        for item in tokenized_items:
-            item_operator, item_items = item
-
-            expressions.append(tokenize_ldap_to_cypher(item_operator, item_items))
-
-        #Special rules on AND
-        if tokenized_operator == '&' :
-            # Multiple memberOf / member in an AND        
-            memberof_count, member_count = 0, 0
-            memberof_expressions, member_expressions = [], []
-
-            # Query OU info (&(objectClass=OrganizationalUnit)(cn=whatever))
-            is_ou_objectclass = False
-            # Query GPO info (&(objectClass=GroupPolicyContainer)(cn=whatever))
-            is_gpo_objectclass = False
-
-            for index, expression in enumerate(expressions):
-                if "gC.name" in expression:
-                    memberof_count += 1
-                    memberof_expressions.append((index,expression.replace("gC.name", f"g{index}.name")))
-                if "memberC.samaccountname" in expression:
-                    member_count += 1
-                    member_expressions.append((index,expression.replace("memberC.samaccountname", f"member{index}.samaccountname")))
-                
-                match = re.search(r'\bou\.name\b', expression)
-                if match and not expression[match.start() - 1] == '(':
-                    is_ou_objectclass = True
-
-                match = re.search(r'\bgpo\.name\b', expression)
-                if match and not expression[match.start() - 1] == '(':
-                    is_gpo_objectclass = True
-
-                if is_ou_objectclass :
-                    expressions[index] = expression.replace("n.", "ou.")
-                elif is_gpo_objectclass :
-                    expressions[index] = expression.replace("n.", "gpo.")
-
-            if memberof_count > 1:
-                for index, expression in memberof_expressions:
-                    new_value = "EXISTS {{\n\tMATCH (n)-[:MemberOf]->(g{index}:Group)\n\tWHERE {expression}\n}}".format(index = index, expression = expression)
-                    expressions[index] = new_value
-            if member_count > 1 :
-                for index, expression in member_expressions:
-                    new_value = "EXISTS {{\n\tMATCH (n)<-[:MemberOf]-(member{index})\n\tWHERE {expression}\n}}".format(index = index, expression = expression)
-                    expressions[index] = new_value
-
-        # --      
-
-        if tokenized_operator == '|':
-            return "( " + " OR ".join(expressions) + " )"
-        elif tokenized_operator == '&':
-            return  "( " + " AND ".join(expressions) + " )" 
-        elif tokenized_operator == "!":
-            return " NOT ( " + expressions[0] + " )"
-
-def tokenize_ldap_query(tokens) -> tuple:
-    operator = None
-    expressions = []
-
-    while tokens:
-        token = tokens.pop(0)
-        
-        if token == '(':
-            expressions.append(tokenize_ldap_query(tokens))
-        elif token == ')':
-            return (operator, expressions)
-        elif token in ('&', '|', '!'):
-            operator = token
-        else:
-            expressions.append(token)
-
-    return (operator, expressions)
-
-def ldap_to_cypher(query) -> tuple:
-    tokens = re.findall(r'([()|&!])|(\w+[><=~]*=?[^()|&!]+)', query)
-    tokens = [item[0] or item[1] for item in tokens]
-
-    push_debug_info("[•] Tokenized LDAP Query \n\n{msg}\n".format(msg = str(tokens)))
-
-    tokenized_query = tokenize_ldap_query(tokens)[1]
-    if "(" not in query and ")" not in query : 
-        return tokenize_ldap_to_cypher(None, tokenized_query)
-    else:
-        return tokenize_ldap_to_cypher(tokenized_query[0][0], tokenized_query[0][1])
+# FILETIME and epoch integers, as stored on ingest, skip the text parsing
+def parse_timestamp(timestamp) -> str:
+    try:
+        if type(timestamp) is int :
+            return format_integer_timestamp(timestamp)
+        if type(timestamp) is float :
+            return format_integer_timestamp(int(timestamp))
 
+        return parse_timestamp_text(str(timestamp).strip())
+    except Exception:
+        return "Invalid timestamp"
 
-def create_cypher_query(query, attribute_list) -> str:
-    where_clauses = ldap_to_cypher(query)
-    query = query.lower().strip()
+def create_cypher_query(query, attribute_list, count_only = False, split_or = False, paged = False) -> tuple:
+    filter_tree = parse_ldap_filter(query)
+    push_debug_info("[•] Parsed LDAP Filter \n\n{msg}\n".format(msg = str(filter_tree)))
+
+    if split_or and count_only :
+        union_compiler = CypherCompiler()
+        union_query = union_compiler.compile_union_count_query(filter_tree)
+        if union_query != None :
+            return union_query, union_compiler.parameters, None
+
+    compiler = CypherCompiler()
+    cypher_query = compiler.compile_query(filter_tree, attribute_list, count_only, False, paged)
+
+    branch_queries = None
+    if split_or and not count_only :
+        branch_queries = CypherCompiler().compile_branch_queries(filter_tree, attribute_list)
+
+    return cypher_query, compiler.parameters, branch_queries
+
+# -- COMPILED QUERY CACHE --
+class CompiledQuery:
+    def __init__(self, cypher_query, parameters, formatter, branch_queries = None):
+        self.cypher_query = cypher_query
+        self.parameters = parameters
+        self.formatter = formatter
+        # [(cypher_query, parameters)] of each top-level OR branch when they are run concurrently
+        self.branch_queries = branch_queries
+
+# Bounded LRU of LDAP filter + attributes -> compiled Cypher, parameters and record formatter
+class CompiledQueryCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def retrieve(self, key) -> CompiledQuery:
+        with self.lock:
+            if key in self.entries :
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            self.misses += 1
+            return None
+
+    def store(self, key, compiled_query) -> None:
+        with self.lock:
+            self.entries[key] = compiled_query
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+    def retrieve_stats(self) -> str:
+        return "hits: {hits}, misses: {misses}, entries: {entries}/{max_size}".format(hits = self.hits, misses = self.misses, entries = len(self.entries), max_size = self.max_size)
+
+compiled_query_cache = CompiledQueryCache(COMPILED_QUERY_CACHE_SIZE)
+
+# Whitespace around parentheses and attribute case don't change the compiled query,
+# a schema refresh does since index hints follow the indexes of the database
+def normalize_query_key(query, attribute_list, count_only, split_or, paged) -> tuple:
+    normalized_query = re.sub(r"\s*([()])\s*", r"\1", query.strip())
+
+    normalized_attributes = None
+    if attribute_list :
+        normalized_attributes = tuple(attribute.lower().strip() for attribute in attribute_list)
 
-    # 1- MATCH
-    cypher_query = "MATCH (n)"
+    return normalized_query, normalized_attributes, count_only, split_or, paged, Neo4jConnector.schema_version
 
-    if re.search(r"\bou\b", query):
-        cypher_query = "MATCH (ou:OU)-[:Contains]->(n)"
-    if re.search(r"\bgpo\b", query):
-        cypher_query = "MATCH (gpo:GPO)-[:GPLink]->(n)"
-    if re.search(r"\bcontainer\b", query) :
-        cypher_query = "MATCH (container:Container)-[:Contains]->(n)"
+# Formatters are built once per compiled query, records only run the resolved columns
+def create_record_formatter(attributes) -> callable:
+    if attributes :
+        return create_attribute_formatter(compile_result_columns(attributes))
 
-    if "organizationalunit" in query:
-        cypher_query = "MATCH (ou:OU)"
-    if "grouppolicycontainer" in query :
-        cypher_query = "MATCH (gpo:GPO)"
+    return format_full_record
 
-        
-    if re.search(r'\bmemberof\b', query) and re.search(r'\bmember\b', query):        
-        cypher_query += "-[:MemberOf]->(gC:Group)<-[:MemberOf]-(memberC)\n"
-    elif ("memberof" in query):
-        cypher_query += "-[:MemberOf]->(gC:Group)\n"
-    elif "member" in query :
-        cypher_query += "<-[:MemberOf]-(memberC)\n"
-    else:
-        cypher_query += "\n"
-
-    # 2- WHERE
-    cypher_query += "WHERE {where_clauses}\n".format(where_clauses = where_clauses)    
-
-    # 3- OPTIONAL MATCH
-    if("organizationalunit" not in query and "grouppolicycontainer" not in query):
-        cypher_query += "OPTIONAL MATCH (n)-[:MemberOf]->(g:Group)\nOPTIONAL MATCH (n)<-[:MemberOf]-(member)\n"
-
-    # 4- WITH 
-    if "grouppolicycontainer" in query : 
-        cypher_query += "WITH gpo AS n, '' as memberof, '' as member\n"
-    elif "organizationalunit" in query : 
-        cypher_query += "WITH ou AS n, '' as memberof, '' as member\n"
-    elif re.search(r'=\s*container', query) : 
-        cypher_query += "WITH container AS n, '' as memberof, '' as member\n"
-    
-    elif attribute_list == None :
-        cypher_query += "WITH n, collect('memberOf: ' + g.name) AS memberof, collect('member : ' + member.name) as member\n"
+def compile_ldap_query(query, attributes, count_only = False, split_or = False, paged = False) -> CompiledQuery:
+    query_key = normalize_query_key(query, attributes, count_only, split_or, paged)
 
-    # 5- RETURN
-    attributes = ""
-    if attribute_list :
-        attributes_tmp = ""
-        for attribute in attribute_list:
-            attribute = adapt_attribute_to_cypher(attribute)
-            attributes_tmp += "{attr}, ".format(attr = attribute)
-        
-        attributes += attributes_tmp[:-2]
-    else:
-        attributes = "n, memberof, member"
+    compiled_query = compiled_query_cache.retrieve(query_key)
+    if compiled_query != None :
+        push_debug_info("[•] Compiled query cache hit ({stats})\n".format(stats = compiled_query_cache.retrieve_stats()))
+        return compiled_query
 
-    cypher_query += "RETURN DISTINCT {attributes}".format(attributes = attributes)
+    cypher_query, parameters, branch_queries = create_cypher_query(query, attributes, count_only, split_or, paged)
+    compiled_query = CompiledQuery(cypher_query, parameters, create_record_formatter(attributes), branch_queries)
+    compiled_query_cache.store(query_key, compiled_query)
+    push_debug_info("[•] Compiled query cache miss ({stats})\n".format(stats = compiled_query_cache.retrieve_stats()))
 
-    return cypher_query
+    return compiled_query
 
 
 # -- OUTPUT FORMATING FUNCTIONS --
-def format_spn(remaining_attrs) -> str:
-    ldap_output = ""
-    if remaining_attrs != [] :
+# Records are formatted as (key, value) rows
+def format_spn(remaining_attrs) -> list:
+    rows = []
+    if remaining_attrs :
         for principal in remaining_attrs:
-            ldap_output += "serviceprincipalnames: " +  principal + "\n"
+            rows.append(("serviceprincipalnames", principal))
 
-    return ldap_output
+    return rows
 
-def format_membership_list(remaining_attrs) -> str:
-    ldap_output = ""
+def format_membership_list(key, remaining_attrs) -> list:
+    rows = []
 
-    for group in set(remaining_attrs):
-        ldap_output += group + "\n"
-    
-    return ldap_output
-
-def format_others_output(remaining_attrs) -> str:
-    ignore_list = ["owned", "sensitive", "lastlogon"]
-
-    ldap_output = ""
-    for attribute in remaining_attrs:
-        if attribute not in ignore_list :
-            ldap_output += attribute + ": " + str(remaining_attrs[attribute]) + "\n"
+    for name in dict.fromkeys(remaining_attrs):
+        rows.append((key, name))
 
-    return ldap_output
+    return rows
 
-def format_computer_output(remaining_attrs) -> tuple:
-    computer_attrs_order = ["serviceprincipalnames", "dnshostname", "trustedtoauth", "unconstraineddelegation", "allowedtodelegate"]
-    ldap_output = ""
+# -- Full records --
+GENERAL_ATTRIBUTES = ["name", "samaccountname", "userprincipalname", "distinguishedname", "displayname", "title", "description", "objectid", "domain", "domainsid", "enabled", "useraccountcontrol", "highvalue"]
+COMPUTER_ATTRIBUTES = ["dnshostname", "trustedtoauth", "unconstraineddelegation", "allowedtodelegate"]
 
-    if "serviceprincipalnames" in remaining_attrs and "serviceprincipalname" in remaining_attrs :
-        remaining_attrs.pop("serviceprincipalname")
+# Properties left out of the raw output, already shown or never shown
+GENERAL_SHOWN_ATTRIBUTES = set(GENERAL_ATTRIBUTES + DATE_ATTRIBUTES + ["memberof", "member", "ntsecuritydescriptor", "owned", "sensitive", "lastlogon"])
+COMPUTER_SHOWN_ATTRIBUTES = GENERAL_SHOWN_ATTRIBUTES | set(COMPUTER_ATTRIBUTES + ["serviceprincipalnames", "serviceprincipalname"])
 
-    if "serviceprincipalnames" in remaining_attrs : #Computer
-        for attribute in computer_attrs_order:
-            if attribute == "serviceprincipalnames" :
-                ldap_output += format_spn(remaining_attrs.pop("serviceprincipalnames"))
-            else:
-                if attribute in remaining_attrs :
-                    ldap_output += attribute + ": " + str(remaining_attrs.pop(attribute)) + "\n"
+# Node properties are read in place, general attributes first and computer ones when the node has SPNs
+def format_full_record(record, raw) -> list:
+    properties = record["n"]
+    rows = []
 
-    return remaining_attrs, ldap_output
-    
-def format_general_output(remaining_attrs) -> tuple:
-    important_attrs_order = ["name", "samaccountname", "userprincipalname", "distinguishedname", "displayname", "title", "description", "objectid", "domain", "domainsid", "enabled", "useraccountcontrol", "highvalue"]
-    date_attrs_order = ["whencreated", "lastlogontimestamp", "pwdlastset"]
-    
-    ldap_output = ""
+    for attribute in GENERAL_ATTRIBUTES:
+        attribute_value = properties.get(attribute)
+        if attribute_value :
+            rows.append((attribute, str(attribute_value)))
 
-    for attribute in important_attrs_order:
-        if attribute in remaining_attrs :
-            attribute_value = remaining_attrs.pop(attribute)
-            if attribute_value :
-                ldap_output += attribute + ": " + str(attribute_value) + "\n"
+    rows += format_membership_list("memberOf", record["memberof"])
 
-    ldap_output += format_membership_list(remaining_attrs.pop("memberof"))
-    
-    for attribute in date_attrs_order:
-        if attribute in remaining_attrs :
-            ldap_output += attribute + ": " + str(parse_timestamp(remaining_attrs.pop(attribute))) + "\n"
+    for attribute in DATE_ATTRIBUTES:
+        if attribute in properties :
+            rows.append((attribute, str(parse_timestamp(properties[attribute]))))
 
-    ldap_output += format_membership_list(remaining_attrs.pop("member"))
+    rows += format_membership_list("member", record["member"])
 
-    return remaining_attrs, ldap_output
+    is_computer = "serviceprincipalnames" in properties
+    if is_computer :
+        rows += format_spn(properties["serviceprincipalnames"])
+        for attribute in COMPUTER_ATTRIBUTES:
+            if attribute in properties :
+                rows.append((attribute, str(properties[attribute])))
 
-# -- Format by attributes -- 
-def format_special_attributes(attribute, remaining_attrs) -> str:
-    special_attr_output = ""
-    special_attributes = ["member", "memberof", "serviceprincipalnames"]
+    if raw :
+        shown_attributes = COMPUTER_SHOWN_ATTRIBUTES if is_computer else GENERAL_SHOWN_ATTRIBUTES
+        for attribute, attribute_value in properties.items():
+            if attribute not in shown_attributes :
+                rows.append((attribute, str(attribute_value)))
 
-    if attribute == special_attributes[0] :
-        special_attr_output += format_membership_list(remaining_attrs["member"])
-    elif attribute == special_attributes[1] :
-        special_attr_output += format_membership_list(remaining_attrs["memberof"])
-    elif attribute == special_attributes[2] :
-        special_attr_output += format_spn(remaining_attrs["serviceprincipalnames"][0][1:])
+    return rows
 
-    return special_attr_output
+# -- Records by attributes --
+MISSING_VALUE = object()
 
-def format_by_attributes(attribute, remaining_attrs) -> str:
-    attr_output = ""
+def create_attribute_formatter(result_columns) -> callable:
+    def format_record(record, raw) -> list:
+        rows = []
+        for record_key, shown_key, column_kind in result_columns:
+            value = record.get(record_key, MISSING_VALUE)
+            if value is MISSING_VALUE :
+                continue
 
-    special_attributes = ["member", "memberof", "serviceprincipalnames"]
-    date_attributes = ["whencreated", "lastlogontimestamp", "pwdlastset"]
+            if column_kind == "value" :
+                rows.append((shown_key, str(value)))
+            elif column_kind == "date" :
+                rows.append((shown_key, str(parse_timestamp(value))))
+            elif column_kind == "membership" :
+                rows += format_membership_list(shown_key, value)
+            else:
+                rows += format_spn(value)
 
-    if attribute in special_attributes :
-        attr_output += format_special_attributes(attribute, remaining_attrs)
-    elif attribute  in date_attributes :
-        item_key = adapt_attribute_to_cypher(attribute)
-        attr_output += item_key.split(".")[1] + ": " + str(parse_timestamp(remaining_attrs.pop(item_key))) + "\n"
-    else:
-        item_key = adapt_attribute_to_cypher(attribute)
-        if item_key in remaining_attrs :
-            if("-" in item_key):
-                attr_output += item_key.split(".")[1].strip("`") + ": " + str(remaining_attrs[item_key]) + "\n"
-            else:      
-                attr_output += item_key.split(".")[1] + ": " + str(remaining_attrs[item_key]) + "\n"
+        return rows
 
-    return attr_output
+    return format_record
 
 # --
+# The names of the modified nodes keep the owned node set of the controller in sync
+# The objectid comes from the graph as stored, an exact match can use the objectid constraint
 def set_ownership(owned, object_type, object_id) -> None:
     query = ""
     if(owned):
         query = """
-        MATCH (n)
-        WHERE ( n:{object_type} AND toUpper(n.objectid) = '{object_id}' )
+        MATCH (n:{object_type} {{objectid: $object_id}})
         SET n:Owned
-        """.format(object_type = object_type, object_id = object_id)
+        RETURN n.name AS name
+        """.format(object_type = object_type)
     else:
         query = """
-        MATCH (n)
-        WHERE ( n:{object_type} AND toUpper(n.objectid) = '{object_id}' )
+        MATCH (n:{object_type} {{objectid: $object_id}})
         REMOVE n:Owned
-        """.format(object_type = object_type, object_id = object_id)
+        RETURN n.name AS name
+        """.format(object_type = object_type)
 
+    controller = N4LController().get_instance()
     with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
         try:
-            _ = session.run(query) 
+            result = session.run(query, object_id = object_id)
+            names = [record["name"] for record in result if record["name"] is not None]
+
+            controller.update_owned_nodes(names, owned)
         except:
-            controller = N4LController().get_instance()
             controller.notify_error(traceback.format_exc())
 
 def retrieve_owned_nodes() -> list:
@@ -431,80 +321,762 @@ def retrieve_owned_nodes() -> list:
 
     return owned_nodes
 
+# -- BULK OWNERSHIP --
+SID_PATTERN = re.compile(r"^S-1-[0-9-]+$", re.IGNORECASE)
+
+# NetBIOS name -> DNS name of every ingested domain, from the netbios property when the collector
+# stored it and from the first label of the DNS name otherwise (CORP.LOCAL -> CORP)
+def retrieve_netbios_domains(session) -> dict:
+    netbios_domains = {}
+    result = session.run("""
+    MATCH (d:Domain)
+    WHERE d.name IS NOT NULL
+    RETURN toUpper(d.name) AS name, toUpper(d.netbios) AS netbios
+    """)
+
+    for record in sorted(result, key = lambda record: record["netbios"] is None):
+        netbios = record["netbios"] if record["netbios"] is not None else record["name"].split(".")[0]
+        netbios_domains.setdefault(netbios, record["name"])
+
+    return netbios_domains
+
+# SIDs are matched on objectid. Names are tried on name (USER@CORP.LOCAL, HOST.CORP.LOCAL) and then on samaccountname,
+# DOMAIN\NAME is restricted to that domain with NetBIOS names mapped to their DNS name
+def normalize_ownership_entry(entry, netbios_domains) -> dict:
+    value = entry.upper()
+    if SID_PATTERN.match(value) :
+        return {"entry": entry, "objectid": value, "name": None, "samaccountname": None, "domain": None}
+
+    if "\\" in value :
+        domain, _, samaccountname = value.partition("\\")
+        domain = netbios_domains.get(domain, domain)
+        return {"entry": entry, "objectid": None, "name": "{name}@{domain}".format(name = samaccountname, domain = domain), "samaccountname": samaccountname, "domain": domain}
+
+    return {"entry": entry, "objectid": None, "name": value, "samaccountname": value, "domain": None}
+
+# Names are stored upper-cased and seeked on the per-label name indexes, samaccountname is not indexed and its case
+# varies between collectors so it's only scanned for the entries still unresolved. Every match of an entry is returned
+def resolve_ownership_names(session, name_entries) -> dict:
+    indexed_properties = retrieve_indexed_properties()
+    names = list({entry["name"] for entry in name_entries})
+
+    objectids_by_name = {}
+    for label in NAME_INDEXED_LABELS:
+        index_hint = "USING INDEX n:{label}(name)".format(label = label) if "name" in indexed_properties.get(label, set()) else ""
+        result = session.run("""
+        MATCH (n:{label}) {index_hint}
+        WHERE n.name IN $names
+        RETURN n.objectid AS objectid, n.name AS name
+        """.format(label = label, index_hint = index_hint), names = names)
+
+        for record in result:
+            objectids_by_name.setdefault(record["name"], set()).add(record["objectid"])
+
+    entry_objectids = {}
+    for entry in name_entries:
+        if entry["name"] in objectids_by_name :
+            entry_objectids[entry["entry"]] = sorted(objectids_by_name[entry["name"]])
+
+    unresolved_entries = [entry for entry in name_entries if entry["entry"] not in entry_objectids]
+    if not unresolved_entries :
+        return entry_objectids
+
+    objectids_by_samaccountname = {}
+    result = session.run("""
+    MATCH (n:Base)
+    WHERE toUpper(n.samaccountname) IN $samaccountnames
+    RETURN n.objectid AS objectid, toUpper(n.samaccountname) AS samaccountname, toUpper(n.domain) AS domain
+    """, samaccountnames = list({entry["samaccountname"] for entry in unresolved_entries}))
+
+    for record in result:
+        objectids_by_samaccountname.setdefault(record["samaccountname"], set()).add((record["objectid"], record["domain"]))
+
+    for entry in unresolved_entries:
+        objectids = {objectid for objectid, domain in objectids_by_samaccountname.get(entry["samaccountname"], ()) if entry["domain"] is None or domain == entry["domain"]}
+        entry_objectids[entry["entry"]] = sorted(objectids)
+
+    return entry_objectids
+
+def create_bulk_ownership_query(owned) -> str:
+    return """
+    UNWIND $objectids AS objectid
+    MATCH (n:Base {{objectid: objectid}})
+    {action} n:Owned
+    RETURN n.objectid AS objectid, n.name AS name
+    """.format(action = "SET" if owned else "REMOVE")
+
+def set_bulk_ownership(owned, entries, file_path = "") -> None:
+    controller = N4LController().get_instance()
+
+    try:
+        if file_path != "" :
+            entries = entries + read_values_file(file_path)
+
+        # secretsdump style lines (domain\name:rid:lm:nt:::) only keep the name, hashes never reach the query or the report
+        entries = [entry.split(":")[0].strip() for entry in entries]
+        entries = list(dict.fromkeys(entry for entry in entries if entry != ""))
+        if not entries :
+            controller.notify_no_results("No names or SIDs were provided")
+            return
+
+        names = []
+        matched_objectids = set()
+        with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+            netbios_domains = retrieve_netbios_domains(session)
+            normalized_entries = [normalize_ownership_entry(entry, netbios_domains) for entry in entries]
+
+            entry_objectids = {entry["entry"]: [entry["objectid"]] for entry in normalized_entries if entry["objectid"] is not None}
+            name_entries = [entry for entry in normalized_entries if entry["objectid"] is None]
+            if name_entries :
+                entry_objectids.update(resolve_ownership_names(session, name_entries))
+
+            # A bare name matching accounts of several domains (administrator) only marks one when qualified with its domain
+            ambiguous_entries = [entry for entry in entries if len(entry_objectids.get(entry, [])) > 1]
+            for entry in ambiguous_entries:
+                entry_objectids[entry] = []
+
+            objectids = list({objectid for objectids in entry_objectids.values() for objectid in objectids})
+            result = session.run(create_bulk_ownership_query(owned), objectids = objectids)
+            for record in result:
+                matched_objectids.add(record["objectid"])
+                if record["name"] is not None :
+                    names.append(record["name"])
+
+        controller.update_owned_nodes(names, owned)
+
+        unresolved_entries = [entry for entry in entries if entry not in ambiguous_entries and not matched_objectids.intersection(entry_objectids.get(entry, []))]
+        resolved_count = len(entries) - len(unresolved_entries) - len(ambiguous_entries)
+        push_debug_info("[✓] {action} {count} nodes as owned ({resolved}/{total} entries resolved)\n".format(action = "Marked" if owned else "Unmarked", count = len(set(names)), resolved = resolved_count, total = len(entries)))
+
+        unknown_domains = sorted({entry["domain"] for entry in normalized_entries if entry["domain"] is not None and entry["domain"] not in netbios_domains.values()})
+        if unknown_domains :
+            push_debug_info("[!] Domains not found in the database: {domains}\n".format(domains = ", ".join(unknown_domains)))
+
+        if ambiguous_entries :
+            push_debug_info("[!] Ambiguous entries, use DOMAIN\\name or the SID\n\n{entries}\n".format(entries = "\n".join(ambiguous_entries)))
+
+        if unresolved_entries :
+            push_debug_info("[!] Unresolved entries\n\n{entries}\n".format(entries = "\n".join(unresolved_entries)))
+
+        if unresolved_entries or ambiguous_entries :
+            controller.notify_no_results("{count} of {total} entries couldn't be resolved, they are listed in the debug panel".format(count = len(unresolved_entries) + len(ambiguous_entries), total = len(entries)))
+    except:
+        controller.notify_error(traceback.format_exc())
+
+# -- VALUES FROM FILE --
+# One value per line, empty lines and lines starting with # are skipped
+def read_values_file(file_path) -> list:
+    values = []
+    with open(file_path, "r", encoding="utf-8-sig") as values_file:
+        for line in values_file:
+            value = line.strip()
+            if value != "" and not value.startswith("#") :
+                values.append(value)
+
+    return values
+
+def load_values_filter(attribute, file_path) -> str:
+    try:
+        values = list(dict.fromkeys(read_values_file(file_path)))
+        if not values :
+            raise ValueError("No values found in {file}".format(file = file_path))
+
+        push_debug_info("[•] Loaded {count} {attribute} values from {file}\n".format(count = len(values), attribute = attribute, file = file_path))
+        return build_values_filter(attribute.strip().lower(), values)
+    except:
+        controller = N4LController().get_instance()
+        controller.notify_error(traceback.format_exc())
+
+    return None
+
 # -- 
 def push_debug_info(msg) -> None:
     controller = N4LController().get_instance()
     controller.push_debug_info(msg)
-    
-def parse_record(record, attributes, raw) -> str:
-    remaining_attrs = {}
-    ldap_output = ""
-
-    for item_key, item_value in record.items():
-        if item_key == "n" :
-            for property_key, property_value in item_value.items():
-                remaining_attrs[property_key] = property_value
-        else:
-            remaining_attrs[item_key] = item_value
 
-    if "ntsecuritydescriptor" in remaining_attrs :
-        remaining_attrs.pop("ntsecuritydescriptor")
+# Side-stored properties are not on the nodes, requested attributes (or every property on raw full records) are reported
+def notify_side_stored_attributes(attributes, raw) -> None:
+    side_store_properties = load_side_store_properties()
 
     if attributes :
-        for attribute in attributes:
-            attribute = attribute.lower()
-            ldap_output += format_by_attributes(attribute, remaining_attrs)
+        missing_attributes = [attribute for attribute in attributes if attribute.lower() in side_store_properties]
+    elif raw :
+        missing_attributes = sorted(side_store_properties)
+    else:
+        missing_attributes = []
+
+    if missing_attributes :
+        push_debug_info("[!] Not returned, moved to the side store on ingest ({path}): {attributes}\n".format(path = retrieve_side_store_path(), attributes = ", ".join(missing_attributes)))
+    
+# -- QUERY PLANS --
+# Plans of the queries run for one LDAP request, EXPLAIN runs apart since it doesn't return records
+class QueryPlanReport:
+    def __init__(self, plan_mode):
+        self.plan_mode = plan_mode
+        self.plan_summaries = []
+        self.lock = threading.Lock()
+
+    def run(self, session, task, cypher_query, parameters) -> object:
+        if self.plan_mode == PLAN_MODE_EXPLAIN :
+            self.report(session.run(task.create_query(apply_plan_mode(cypher_query, self.plan_mode)), parameters).consume().plan)
+            return session.run(task.create_query(cypher_query), parameters)
+
+        return session.run(task.create_query(apply_plan_mode(cypher_query, self.plan_mode)), parameters)
+
+    # The profile is only available once every record has been pulled
+    def collect(self, result) -> None:
+        if self.plan_mode == PLAN_MODE_PROFILE :
+            self.report(result.consume().profile)
+
+    def report(self, plan) -> None:
+        if plan == None :
+            return
+
+        plan_summary = summarize_plan(plan)
+        with self.lock:
+            self.plan_summaries.append(plan_summary)
+
+        push_debug_info(format_plan_summary(plan_summary, self.plan_mode))
+
+    def retrieve_db_hits(self) -> int:
+        db_hits = [plan_summary["db_hits"] for plan_summary in self.plan_summaries if plan_summary["db_hits"] != None]
+        if not db_hits :
+            return None
+
+        return sum(db_hits)
+
+def log_slow_query(query, attributes, compiled_query, query_type, elapsed_ms, record_count, plan_report, query_settings) -> None:
+    db_hits = plan_report.retrieve_db_hits()
+    if not is_slow_query(elapsed_ms, db_hits, query_settings) :
+        return
+
+    if compiled_query.branch_queries != None :
+        cypher_query = [branch_query for branch_query, _ in compiled_query.branch_queries]
     else:
-        remaining_attrs, ldap_output_tmp = format_general_output(remaining_attrs)
-        ldap_output += ldap_output_tmp
+        cypher_query = compiled_query.cypher_query
+
+    slow_query = {
+        "timestamp": datetime.now().isoformat(timespec = "seconds"),
+        "type": query_type,
+        "ldap": query,
+        "attributes": attributes,
+        "cypher": cypher_query,
+        "elapsed_ms": round(elapsed_ms),
+        "records": record_count,
+        "db_hits": db_hits,
+        "plans": plan_report.plan_summaries
+    }
+
+    controller = N4LController().get_instance()
+    controller.append_slow_query_log(slow_query)
+
+    push_debug_info("[!] Slow query logged ({elapsed} ms)".format(elapsed = round(elapsed_ms)))
+
+# Formatted rows are pushed to the view every RESULT_CHUNK_SIZE records, so they show up while the cursor is consumed
+# The first chunk replaces the table unless the records continue a previous page
+def stream_records(records, compiled_query, raw, owned_nodes, append = False) -> int:
+    controller = N4LController().get_instance()
 
-        remaining_attrs, ldap_output_tmp = format_computer_output(remaining_attrs)
-        ldap_output += ldap_output_tmp
+    rows = []
+    record_count = 0
+    for record in records:
+        rows += compiled_query.formatter(record, raw)
+        rows += RECORD_SEPARATOR_ROWS
+        record_count += 1
 
-        if raw :
-            ldap_output += format_others_output(remaining_attrs)
+        if record_count % RESULT_CHUNK_SIZE == 0 :
+            if record_count == RESULT_CHUNK_SIZE and not append :
+                controller.redraw_LDAP_result_table(rows, owned_nodes)
+            else:
+                controller.append_LDAP_result_rows(rows)
+            rows = []
+
+    if rows :
+        if record_count <= RESULT_CHUNK_SIZE and not append :
+            controller.redraw_LDAP_result_table(rows, owned_nodes)
+        else:
+            controller.append_LDAP_result_rows(rows)
+
+    return record_count
+
+def execute_query(compiled_query, raw, owned_nodes, task, plan_report) -> int:
+    if compiled_query.branch_queries != None :
+        return stream_records(execute_branch_queries(compiled_query, task, plan_report), compiled_query, raw, owned_nodes)
+
+    with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+        result = plan_report.run(session, task, compiled_query.cypher_query, compiled_query.parameters)
+        record_count = stream_records(task.track(result), compiled_query, raw, owned_nodes)
+        plan_report.collect(result)
 
-    return ldap_output
+        return record_count
 
-def execute_query(query, attributes, raw) -> str:
+def execute_count_query(compiled_query, task, plan_report) -> int:
     with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+        result = plan_report.run(session, task, compiled_query.cypher_query, compiled_query.parameters)
+        count = result.single()["count"]
+        plan_report.collect(result)
+
+        return count
+
+# -- OR BRANCHES --
+def retrieve_record_objectid(record) -> str:
+    if "objectid" in record.keys() :
+        return record["objectid"]
+    if "n" in record.keys() :
+        return record["n"].get("objectid")
+
+    return None
+
+# Waits for room in the queue until the merge stops reading
+def put_branch_item(record_queue, item, stopped) -> bool:
+    while not stopped.is_set():
         try:
-            result = session.run(query)
-        except:
-            controller = N4LController().get_instance()
+            record_queue.put(item, timeout = 0.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+def run_branch_query(branch_query, task, plan_report, record_queue, stopped) -> None:
+    cypher_query, parameters = branch_query
+
+    try:
+        with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+            result = plan_report.run(session, task, cypher_query, parameters)
+            for record in task.track(result):
+                if not put_branch_item(record_queue, record, stopped) :
+                    return
+
+            plan_report.collect(result)
+    except Exception as error:
+        put_branch_item(record_queue, error, stopped)
+    finally:
+        put_branch_item(record_queue, BRANCH_DONE, stopped)
+
+# Every branch streams on its own pooled session into a bounded queue, records are yielded as they arrive
+# without repeated objectids. A failing branch stops the merge and its error is raised to the caller
+def execute_branch_queries(compiled_query, task, plan_report) -> iter:
+    branch_count = len(compiled_query.branch_queries)
+    record_queue = queue.Queue(maxsize = BRANCH_QUEUE_SIZE)
+    stopped = threading.Event()
+
+    executor = ThreadPoolExecutor(max_workers = min(branch_count, OR_BRANCH_WORKERS))
+    try:
+        for branch_query in compiled_query.branch_queries:
+            executor.submit(run_branch_query, branch_query, task, plan_report, record_queue, stopped)
+
+        seen_objectids = set()
+        running_branches = branch_count
+        while running_branches > 0:
+            item = record_queue.get()
+            if item is BRANCH_DONE :
+                running_branches -= 1
+                continue
+            if isinstance(item, Exception) :
+                raise item
+
+            objectid = retrieve_record_objectid(item)
+            if objectid != None :
+                if objectid in seen_objectids :
+                    continue
+                seen_objectids.add(objectid)
+
+            yield item
+    finally:
+        stopped.set()
+        executor.shutdown(wait = False, cancel_futures = True)
+
+# -- PAGING --
+# Last paged LDAP query, next pages continue after the last objectid shown
+class PagedQuery:
+    def __init__(self, query, attributes, compiled_query, raw, owned_nodes, page_size):
+        self.query = query
+        self.attributes = attributes
+        self.compiled_query = compiled_query
+        self.raw = raw
+        self.owned_nodes = owned_nodes
+        self.page_size = page_size
+
+        self.last_objectid = None
+        self.loaded_count = 0
+        self.total_count = None
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+active_paged_query = None
+
+def track_last_objectid(records, paged_query) -> object:
+    for record in records:
+        paged_query.last_objectid = retrieve_record_objectid(record)
+        yield record
+
+def fetch_page(paged_query, task, plan_report) -> int:
+    parameters = dict(paged_query.compiled_query.parameters)
+    parameters["last_objectid"] = paged_query.last_objectid
+    parameters["page_size"] = paged_query.page_size
+
+    with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+        result = plan_report.run(session, task, paged_query.compiled_query.cypher_query, parameters)
+        record_count = stream_records(track_last_objectid(task.track(result), paged_query), paged_query.compiled_query, paged_query.raw, paged_query.owned_nodes, paged_query.loaded_count > 0)
+        plan_report.collect(result)
+
+    paged_query.loaded_count += record_count
+    paged_query.exhausted = record_count < paged_query.page_size
+
+    return record_count
+
+def notify_page_status(paged_query) -> None:
+    controller = N4LController().get_instance()
+    controller.update_LDAP_result_status(paged_query.loaded_count, paged_query.total_count, not paged_query.exhausted)
+
+# Totals are counted on their own "count" task and thread so the results they describe never wait for them,
+# on_total receives the count once it's known. A failed count only leaves the total unknown
+def start_total_count(query, attributes, task_group, on_total) -> QueryTask:
+    controller = N4LController().get_instance()
+    count_task = Neo4jConnector.start_query_task("count", controller.retrieve_query_timeout("count"), task_group)
+
+    def count_results() -> None:
+        try:
+            on_total(execute_count_query(compile_ldap_query(query, attributes, True), count_task, QueryPlanReport(PLAN_MODE_OFF)))
+        except Exception as error:
+            if not count_task.cancelled.is_set() :
+                reason = "timed out" if count_task.is_timeout(error) else "failed"
+                push_debug_info("[!] The total count {reason}, only loaded results are shown".format(reason = reason))
+        finally:
+            Neo4jConnector.end_query_task(count_task)
+
+    threading.Thread(target = count_results, daemon = True).start()
+    return count_task
+
+def perform_paged_query(query, attributes, compiled_query, raw, owned_nodes, task, plan_report, query_settings, task_group = None) -> None:
+    global active_paged_query
+    controller = N4LController().get_instance()
+
+    paged_query = PagedQuery(query, attributes, compiled_query, raw, owned_nodes, int(query_settings["page_size"]))
+    active_paged_query = paged_query
+
+    with paged_query.lock:
+        # Paged queries are timed on their first page
+        start_time = time.perf_counter()
+        record_count = fetch_page(paged_query, task, plan_report)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        push_debug_info("[✓] First page executed ({count} results)".format(count = record_count))
+
+        log_slow_query(query, attributes, compiled_query, task.query_type, elapsed_ms, record_count, plan_report, query_settings)
+
+        if record_count == 0 :
+            notify_page_status(paged_query)
+            controller.notify_no_results("LDAP Query didn't return any result")
+            return
+
+        if paged_query.exhausted :
+            paged_query.total_count = paged_query.loaded_count
+
+        notify_page_status(paged_query)
+
+    # The first page is already shown and next pages can load while the total is counted
+    if paged_query.total_count == None :
+        def fill_total_count(total_count) -> None:
+            paged_query.total_count = total_count
+            if active_paged_query is paged_query :
+                notify_page_status(paged_query)
+
+        start_total_count(query, attributes, task_group, fill_total_count)
+
+def perform_next_page() -> None:
+    controller = N4LController().get_instance()
+    paged_query = active_paged_query
+
+    if paged_query == None or paged_query.exhausted :
+        return
+
+    # A page is already being loaded
+    if not paged_query.lock.acquire(blocking = False) :
+        return
+
+    task = Neo4jConnector.start_query_task("ldap", controller.retrieve_query_timeout("ldap"))
+    try:
+        record_count = fetch_page(paged_query, task, QueryPlanReport(PLAN_MODE_OFF))
+        push_debug_info("[✓] Page executed ({count} more results, {loaded} loaded)".format(count = record_count, loaded = paged_query.loaded_count))
+    except Exception as error:
+        if task.is_interrupted(error) :
+            task.notify_interruption(error)
+        else:
             controller.notify_error(traceback.format_exc())
+    finally:
+        Neo4jConnector.end_query_task(task)
 
-        ldap_output = ""
- 
-        has_data = False
-        for record in result:
-            has_data = True
-            ldap_output += parse_record(record, attributes, raw)
-            ldap_output += "\n\n"
+        # Also releases the view after a failed page so it can be requested again
+        notify_page_status(paged_query)
+        paged_query.lock.release()
+
+# -- EXPORT --
+EXPORT_FORMATS = ["csv", "jsonl"]
+EXPORT_PROGRESS_INTERVAL = 1000
+
+# Keys repeated by the formatter, exported as lists
+MULTIVALUED_KEYS = ("memberOf", "member", "serviceprincipalnames")
+
+def fold_record_rows(rows) -> dict:
+    record_values = {}
+    for key, value in rows:
+        if key in MULTIVALUED_KEYS :
+            record_values.setdefault(key, []).append(value)
+        else:
+            record_values[key] = value
+
+    return record_values
+
+# Records are written as they are pulled from the cursor, the keys seen are kept for the CSV header
+def write_jsonl_records(records, compiled_query, raw, export_file, notify_progress) -> tuple:
+    columns = {}
+    record_count = 0
+
+    for record in records:
+        record_values = fold_record_rows(compiled_query.formatter(record, raw))
+        columns.update(dict.fromkeys(record_values))
+
+        export_file.write(json.dumps(record_values, ensure_ascii = False) + "\n")
+        record_count += 1
+
+        if record_count % EXPORT_PROGRESS_INTERVAL == 0 :
+            notify_progress(record_count)
+
+    return record_count, list(columns)
+
+# Columns are only known once every record was seen, the CSV is written from the JSONL in a second pass
+def convert_jsonl_to_csv(jsonl_path, csv_path, columns) -> None:
+    with open(jsonl_path, "r", encoding="utf-8") as jsonl_file, open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames = columns)
+        writer.writeheader()
+
+        for line in jsonl_file:
+            record_values = json.loads(line)
+            for key, value in record_values.items():
+                if isinstance(value, list) :
+                    record_values[key] = "; ".join(value)
+
+            writer.writerow(record_values)
+
+def retrieve_export_format(file_path) -> str:
+    export_format = os.path.splitext(file_path)[1].lower().lstrip(".")
+    if export_format not in EXPORT_FORMATS :
+        raise ValueError("Unsupported export format '{export_format}', use .csv or .jsonl".format(export_format = export_format))
 
-        if not has_data :
-            ldap_output = "No data found"
+    return export_format
 
-        return ldap_output
+# Runs the query on its own session and writes it to file_path, the format comes from the extension
+def export_compiled_query(compiled_query, raw, file_path, task, notify_progress) -> int:
+    export_format = retrieve_export_format(file_path)
+    jsonl_path = file_path if export_format == "jsonl" else file_path + ".tmp"
 
-def perform_query(query, attributes, raw) -> None:    
+    try:
+        with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+            result = session.run(task.create_query(compiled_query.cypher_query), compiled_query.parameters)
+            with open(jsonl_path, "w", encoding="utf-8") as export_file:
+                record_count, columns = write_jsonl_records(task.track(result), compiled_query, raw, export_file, notify_progress)
+
+        if export_format == "csv" :
+            convert_jsonl_to_csv(jsonl_path, file_path, columns)
+    finally:
+        if jsonl_path != file_path and os.path.exists(jsonl_path) :
+            os.remove(jsonl_path)
+
+    return record_count
+
+# Total of the paged query shown in the table when the export is for the same query
+def retrieve_cached_total_count(query, attributes) -> int:
+    paged_query = active_paged_query
+    if paged_query != None and paged_query.query == query and paged_query.attributes == attributes :
+        return paged_query.total_count
+
+    return None
+
+# The export never waits for a count: progress is a running count and the total is filled in when it's known,
+# either from the paged query already shown or from a count query running next to the export
+def perform_export(query, attributes, raw, file_path, task_group = None) -> None:
     controller = N4LController().get_instance()
+    task = Neo4jConnector.start_query_task("export", controller.retrieve_query_timeout("export"), task_group)
+    count_task = None
+
+    export_status = {"exported": 0, "total": None, "finished": False}
+    export_status_lock = threading.Lock()
+
+    def notify_progress(record_count) -> None:
+        with export_status_lock:
+            export_status["exported"] = record_count
+            controller.update_LDAP_export_status(record_count, export_status["total"])
+
+    def fill_total_count(total_count) -> None:
+        with export_status_lock:
+            if not export_status["finished"] :
+                export_status["total"] = total_count
+                controller.update_LDAP_export_status(export_status["exported"], total_count)
 
     try:
-        push_debug_info("[•] LDAP\n\n{msg}\n".format(msg = query))
+        retrieve_export_format(file_path)
+        push_debug_info("[•] Export\n\n{msg}\n".format(msg = query))
+        notify_side_stored_attributes(attributes, raw)
+
+        compiled_query = compile_ldap_query(query, attributes)
+
+        export_status["total"] = retrieve_cached_total_count(query, attributes)
+        controller.update_LDAP_export_status(0, export_status["total"])
+
+        if export_status["total"] == None :
+            count_task = start_total_count(query, attributes, task_group, fill_total_count)
+
+        record_count = export_compiled_query(compiled_query, raw, file_path, task, notify_progress)
+
+        with export_status_lock:
+            export_status["finished"] = True
+            controller.update_LDAP_export_status(record_count, record_count)
+
+        push_debug_info("[✓] Exported {count} results to {file}".format(count = record_count, file = file_path))
+    except Exception as error:
+        if task.is_interrupted(error) :
+            task.notify_interruption(error)
+        else:
+            controller.notify_error(traceback.format_exc())
+    finally:
+        Neo4jConnector.end_query_task(task)
+
+        with export_status_lock:
+            export_status["finished"] = True
+
+        # A count still running once the export is done is no longer needed
+        if count_task != None and Neo4jConnector.running_tasks.get(count_task.task_id) != None :
+            Neo4jConnector.cancel_query_tasks([count_task])
+
+# -- CUSTOM QUERY BATCH --
+def create_batch_file_name(index, name, export_format) -> str:
+    safe_name = re.sub(r"[^\w-]+", "_", name).strip("_") or "query"
+    return "{index:02d}_{name}.{export_format}".format(index = index + 1, name = safe_name, export_format = export_format)
+
+# One custom query of the batch, failures are kept in its summary entry instead of stopping the batch
+def run_batch_query(index, custom_query, output_path, export_format, raw, task) -> dict:
+    file_path = os.path.join(output_path, create_batch_file_name(index, custom_query["name"], export_format))
+    batch_entry = {"name": custom_query["name"], "status": "ok", "rows": 0, "duration_ms": 0, "file": file_path}
+
+    start_time = time.perf_counter()
+    try:
+        # Queries still waiting for a worker are skipped once the batch is cancelled
+        if task.cancelled.is_set() :
+            raise QueryCancelledError()
+
+        notify_side_stored_attributes(custom_query["attributes"], raw)
+        compiled_query = compile_ldap_query(custom_query["query"], custom_query["attributes"])
+        batch_entry["rows"] = export_compiled_query(compiled_query, raw, file_path, task, lambda record_count: None)
+    except Exception as error:
+        if task.is_interrupted(error) :
+            batch_entry["status"] = "timeout" if task.is_timeout(error) else "cancelled"
+        else:
+            batch_entry["status"] = "error: {error}".format(error = str(error).strip().splitlines()[0] if str(error).strip() else type(error).__name__)
+    batch_entry["duration_ms"] = round((time.perf_counter() - start_time) * 1000)
+
+    if batch_entry["status"] != "ok" :
+        batch_entry["file"] = ""
+
+    push_debug_info("[{mark}] {name}: {status}, {rows} rows in {duration} ms".format(mark = "✓" if batch_entry["status"] == "ok" else "!", name = batch_entry["name"], status = batch_entry["status"], rows = batch_entry["rows"], duration = batch_entry["duration_ms"]))
+    return batch_entry
+
+def write_batch_summary(output_path, batch_entries) -> str:
+    summary_path = os.path.join(output_path, "N4L_batch_summary.csv")
+    with open(summary_path, "w", encoding="utf-8", newline="") as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames = ["name", "status", "rows", "duration_ms", "file"])
+        writer.writeheader()
+        writer.writerows(batch_entries)
+
+    return summary_path
 
-        cypher_query = create_cypher_query(query, attributes)
-        push_debug_info("[•] Cypher\n\n{msg}\n".format(msg = cypher_query))
+# Every custom query is exported to its own file in output_path, workers queries run at once on pooled sessions
+def run_custom_query_batch(custom_queries, output_path, export_format, workers, raw, task_group = None) -> None:
+    controller = N4LController().get_instance()
+    task = Neo4jConnector.start_query_task("export", controller.retrieve_query_timeout("export"), task_group)
+
+    try:
+        if export_format not in EXPORT_FORMATS :
+            raise ValueError("Unsupported export format '{export_format}', use csv or jsonl".format(export_format = export_format))
+
+        push_debug_info("[•] Running {count} custom queries ({workers} at once)\n".format(count = len(custom_queries), workers = workers))
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = max(1, min(workers, len(custom_queries)))) as executor:
+            futures = [executor.submit(run_batch_query, index, custom_query, output_path, export_format, raw, task) for index, custom_query in enumerate(custom_queries)]
+            batch_entries = [future.result() for future in futures]
+
+        summary_path = write_batch_summary(output_path, batch_entries)
 
-        ldap_output = execute_query(cypher_query, attributes, raw)
-        push_debug_info("[✓] Query executed")
+        summary_lines = ["{name}: {status}, {rows} rows, {duration} ms".format(name = entry["name"], status = entry["status"], rows = entry["rows"], duration = entry["duration_ms"]) for entry in batch_entries]
+        push_debug_info("[✓] Custom query batch finished in {duration} ms\n\n{summary}\n\nSummary written to {file}\n".format(duration = round((time.perf_counter() - start_time) * 1000), summary = "\n".join(summary_lines), file = summary_path))
+    except:
+        controller.notify_error(traceback.format_exc())
+    finally:
+        Neo4jConnector.end_query_task(task)
+
+def perform_query(query, attributes, raw, count_only = False, split_or = False, task_group = None) -> None:
+    controller = N4LController().get_instance()
 
-        owned_nodes = retrieve_owned_nodes()
+    query_type = "count" if count_only else "ldap"
+    task = Neo4jConnector.start_query_task(query_type, controller.retrieve_query_timeout(query_type), task_group)
 
-        if ldap_output != "No data found" :
-            controller.redraw_LDAP_result_table(ldap_output, owned_nodes)
+    try:
+        push_debug_info("[•] LDAP\n\n{msg}\n".format(msg = query))
+        if not count_only :
+            notify_side_stored_attributes(attributes, raw)
+
+        query_settings = controller.load_query_settings()
+        page_size = int(query_settings["page_size"])
+        paged = page_size > 0 and not count_only and not split_or
+
+        compiled_query = compile_ldap_query(query, attributes, count_only, split_or, paged)
+        if compiled_query.branch_queries != None :
+            push_debug_info("[•] Running {count} OR branches concurrently\n".format(count = len(compiled_query.branch_queries)))
+            for branch_query, branch_parameters in compiled_query.branch_queries:
+                push_debug_info("[•] Cypher\n\n{msg}\n".format(msg = branch_query))
+                if branch_parameters :
+                    push_debug_info("[•] Parameters\n\n{msg}\n".format(msg = branch_parameters))
         else:
+            push_debug_info("[•] Cypher\n\n{msg}\n".format(msg = compiled_query.cypher_query))
+            if compiled_query.parameters :
+                push_debug_info("[•] Parameters\n\n{msg}\n".format(msg = compiled_query.parameters))
+
+        plan_report = QueryPlanReport(query_settings["plan_mode"])
+
+        if count_only :
+            start_time = time.perf_counter()
+            count = execute_count_query(compiled_query, task, plan_report)
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            push_debug_info("[✓] Query executed")
+
+            log_slow_query(query, attributes, compiled_query, query_type, elapsed_ms, 1, plan_report, query_settings)
+
+            controller.redraw_LDAP_result_table([("count", str(count))], [])
+            return
+
+        owned_nodes = controller.retrieve_owned_nodes()
+
+        if paged :
+            perform_paged_query(query, attributes, compiled_query, raw, owned_nodes, task, plan_report, query_settings, task_group)
+            return
+
+        start_time = time.perf_counter()
+        record_count = execute_query(compiled_query, raw, owned_nodes, task, plan_report)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        push_debug_info("[✓] Query executed ({count} results)".format(count = record_count))
+
+        log_slow_query(query, attributes, compiled_query, query_type, elapsed_ms, record_count, plan_report, query_settings)
+
+        controller.update_LDAP_result_status(record_count, record_count, False)
+
+        if record_count == 0 :
             controller.notify_no_results("LDAP Query didn't return any result")
         
-    except:
-        controller.notify_error(traceback.format_exc())
\ No newline at end of file
+    except Exception as error:
+        if task.is_interrupted(error) :
+            task.notify_interruption(error)
+        else:
+            controller.notify_error(traceback.format_exc())
+    finally:
+        Neo4jConnector.end_query_task(task)
\ No newline at end of file
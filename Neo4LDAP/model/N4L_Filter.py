@@ -0,0 +1,266 @@
+# RFC 4515 LDAP search filters -> typed filter tree
+
+FILTER_ESCAPES = {"*": "\\2a", "(": "\\28", ")": "\\29", "\\": "\\5c", "\x00": "\\00"}
+HEX_DIGITS = "0123456789abcdefABCDEF"
+
+def escape_filter_value(value) -> str:
+    escaped_value = []
+    for char in value:
+        escaped_value.append(FILTER_ESCAPES.get(char, char))
+
+    return "".join(escaped_value)
+
+class AndFilter:
+    def __init__(self, children):
+        self.children = children
+
+    def __str__(self) -> str:
+        return "(&" + "".join(str(child) for child in self.children) + ")"
+
+class OrFilter:
+    def __init__(self, children):
+        self.children = children
+
+    def __str__(self) -> str:
+        return "(|" + "".join(str(child) for child in self.children) + ")"
+
+class NotFilter:
+    def __init__(self, child):
+        self.child = child
+
+    def __str__(self) -> str:
+        return "(!" + str(self.child) + ")"
+
+# =, >=, <=, ~= (and the legacy > and < accepted by previous versions)
+class ComparisonFilter:
+    def __init__(self, attribute, operator, value):
+        self.attribute = attribute
+        self.operator = operator
+        self.value = value
+
+    def __str__(self) -> str:
+        return "({attribute}{operator}{value})".format(attribute = self.attribute, operator = self.operator, value = escape_filter_value(self.value))
+
+# Same-attribute equality disjunction collapsed by the compiler, (|(attr=v1)(attr=v2)...)
+class InListFilter:
+    def __init__(self, attribute, values):
+        self.attribute = attribute
+        self.values = values
+
+    def __str__(self) -> str:
+        return "(|" + "".join("({attribute}={value})".format(attribute = self.attribute, value = escape_filter_value(value)) for value in self.values) + ")"
+
+class PresenceFilter:
+    def __init__(self, attribute):
+        self.attribute = attribute
+
+    def __str__(self) -> str:
+        return "({attribute}=*)".format(attribute = self.attribute)
+
+class SubstringFilter:
+    def __init__(self, attribute, initial, any_parts, final):
+        self.attribute = attribute
+        self.initial = initial
+        self.any_parts = any_parts
+        self.final = final
+
+    def __str__(self) -> str:
+        parts = [escape_filter_value(self.initial)] + [escape_filter_value(part) for part in self.any_parts] + [escape_filter_value(self.final)]
+        return "({attribute}={value})".format(attribute = self.attribute, value = "*".join(parts))
+
+class ExtensibleFilter:
+    def __init__(self, attribute, matching_rule, value, dn_attributes = False):
+        self.attribute = attribute
+        self.matching_rule = matching_rule
+        self.value = value
+        self.dn_attributes = dn_attributes
+
+    def __str__(self) -> str:
+        description = self.attribute
+        if self.dn_attributes :
+            description += ":dn"
+        if self.matching_rule :
+            description += ":" + self.matching_rule
+
+        return "({description}:={value})".format(description = description, value = escape_filter_value(self.value))
+
+class LDAPFilterParser:
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+        self.length = len(text)
+
+    def parse(self) -> object:
+        self.skip_whitespaces()
+
+        if self.position < self.length and self.text[self.position] == "(" :
+            filter_node = self.parse_filter()
+        else:
+            # Bare item without parentheses, e.g. cn=DC01*
+            filter_node = self.parse_item(self.length)
+            self.position = self.length
+
+        self.skip_whitespaces()
+        if self.position < self.length :
+            raise ValueError("Unexpected '{text}' at position {position} of the LDAP filter".format(text = self.text[self.position:], position = self.position))
+
+        return filter_node
+
+    def skip_whitespaces(self) -> None:
+        while self.position < self.length and self.text[self.position].isspace():
+            self.position += 1
+
+    def parse_filter(self) -> object:
+        # Current character is '('
+        self.position += 1
+        self.skip_whitespaces()
+
+        if self.position >= self.length :
+            raise ValueError("Empty filter at the end of the LDAP filter")
+
+        char = self.text[self.position]
+        if char == "&" or char == "|" :
+            self.position += 1
+            children = self.parse_filter_list()
+            filter_node = AndFilter(children) if char == "&" else OrFilter(children)
+        elif char == "!" :
+            self.position += 1
+            self.skip_whitespaces()
+            if self.position >= self.length or self.text[self.position] != "(" :
+                raise ValueError("'!' must be followed by a filter at position {position} of the LDAP filter".format(position = self.position))
+            filter_node = NotFilter(self.parse_filter())
+        else:
+            item_end = self.text.find(")", self.position)
+            if item_end == -1 :
+                item_end = self.length
+
+            filter_node = self.parse_item(item_end)
+            self.position = item_end
+
+        self.skip_whitespaces()
+
+        # Missing closing parentheses at the end of the filter are tolerated
+        if self.position < self.length :
+            if self.text[self.position] != ")" :
+                raise ValueError("Expected ')' at position {position} of the LDAP filter".format(position = self.position))
+            self.position += 1
+
+        return filter_node
+
+    def parse_filter_list(self) -> list:
+        children = []
+
+        self.skip_whitespaces()
+        while self.position < self.length and self.text[self.position] == "(" :
+            children.append(self.parse_filter())
+            self.skip_whitespaces()
+
+        return children
+
+    def parse_item(self, item_end) -> object:
+        item = self.text[self.position:item_end].strip()
+
+        operator_index = -1
+        for index, char in enumerate(item):
+            if char in "=~<>:" :
+                operator_index = index
+                break
+
+        if operator_index == -1 :
+            raise ValueError("'{item}' is not a valid LDAP filter item".format(item = item))
+
+        attribute = item[:operator_index].strip().lower()
+
+        if item[operator_index] == ":" :
+            return self.parse_extensible_item(item, operator_index)
+
+        if item.startswith("=", operator_index) :
+            operator = "="
+        elif item[operator_index:operator_index + 2] in (">=", "<=", "~=") :
+            operator = item[operator_index:operator_index + 2]
+        elif item[operator_index] in "<>" :
+            operator = item[operator_index]
+        else:
+            raise ValueError("'{item}' is not a valid LDAP filter item".format(item = item))
+
+        if attribute == "" :
+            raise ValueError("Missing attribute in LDAP filter item '{item}'".format(item = item))
+
+        raw_value = item[operator_index + len(operator):].strip()
+
+        if operator != "=" :
+            return ComparisonFilter(attribute, operator, unescape_filter_value(raw_value))
+
+        if raw_value == "*" :
+            return PresenceFilter(attribute)
+
+        value_parts = split_filter_value(raw_value)
+        if len(value_parts) == 1 :
+            return ComparisonFilter(attribute, operator, value_parts[0])
+
+        return SubstringFilter(attribute, value_parts[0], [part for part in value_parts[1:-1] if part != ""], value_parts[-1])
+
+    def parse_extensible_item(self, item, operator_index) -> ExtensibleFilter:
+        assertion_index = item.find(":=", operator_index)
+        if assertion_index == -1 :
+            raise ValueError("'{item}' is not a valid extensible match".format(item = item))
+
+        attribute = item[:operator_index].strip().lower()
+        dn_attributes = False
+        matching_rule = ""
+
+        for option in item[operator_index + 1:assertion_index].split(":"):
+            option = option.strip()
+            if option.lower() == "dn" :
+                dn_attributes = True
+            elif option != "" :
+                matching_rule = option
+
+        if attribute == "" and matching_rule == "" :
+            raise ValueError("Extensible match '{item}' needs an attribute or a matching rule".format(item = item))
+
+        return ExtensibleFilter(attribute, matching_rule, unescape_filter_value(item[assertion_index + 2:].strip()), dn_attributes)
+
+def unescape_filter_value(raw_value) -> str:
+    return split_filter_value(raw_value, False)[0]
+
+# Splits on unescaped '*' and resolves \XX escapes (UTF-8 octets), a backslash not followed by two hex digits is kept as is
+def split_filter_value(raw_value, split_wildcards = True) -> list:
+    if "\\" not in raw_value :
+        if split_wildcards :
+            return raw_value.split("*")
+        return [raw_value]
+
+    parts = []
+    current_part = bytearray()
+
+    index = 0
+    while index < len(raw_value):
+        char = raw_value[index]
+        hex_pair = raw_value[index + 1:index + 3]
+
+        if char == "\\" and len(hex_pair) == 2 and hex_pair[0] in HEX_DIGITS and hex_pair[1] in HEX_DIGITS :
+            current_part.append(int(hex_pair, 16))
+            index += 3
+            continue
+
+        if char == "*" and split_wildcards :
+            parts.append(current_part.decode("utf-8", errors="replace"))
+            current_part = bytearray()
+        else:
+            current_part.extend(char.encode("utf-8"))
+
+        index += 1
+
+    parts.append(current_part.decode("utf-8", errors="replace"))
+    return parts
+
+def parse_ldap_filter(query) -> object:
+    return LDAPFilterParser(query).parse()
+
+# Equality disjunction for a list of values, e.g. samaccountnames loaded from a file
+def build_values_filter(attribute, values) -> str:
+    if len(values) == 1 :
+        return str(ComparisonFilter(attribute, "=", values[0]))
+
+    return str(InListFilter(attribute, values))
@@ -4,14 +4,30 @@ from neo4j.exceptions import TransientError
 
 from Neo4LDAP.controllers.N4L_Controller import N4LController
 from Neo4LDAP.model.N4L_Common import *
+from Neo4LDAP.model.N4L_ACLs import COMPOSITE_ACES
 
 import time
+import uuid
 import json
 import os
 
 MAX_WORKERS = 10
 MAX_RETRIES = 15
 
+# Properties kept out of the nodes on ingest: "drop" ones are discarded, "side_store" ones and any property
+# over max_property_bytes are written to data/side_store/<database>/<ingest>.jsonl instead. Neither are on the
+# nodes afterwards, LDAP queries and exports can't return them. "keep" always wins over the other rules
+DEFAULT_INGEST_PROJECTION = {
+    "keep": [
+        "name", "samaccountname", "objectid", "distinguishedname", "domain", "domainsid", "description",
+        "serviceprincipalnames", "allowedtodelegate", "sidhistory", "useraccountcontrol",
+        "userpassword", "unixpassword", "unicodepassword", "sfupassword", "ms-mcs-admpwd", "ms-laps-password"
+    ],
+    "drop": ["ntsecuritydescriptor"],
+    "side_store": ["usercertificate", "cacertificate", "certchain", "certthumbprints"],
+    "max_property_bytes": 4096
+}
+
 # Utilities 
 def generate_chunks(data):
     chunks = []
@@ -69,6 +85,112 @@ def run_match_in_neo4j(session, cypher):
                     RuntimeError(traceback.format_exc())
     except Exception:
         raise RuntimeError(traceback.format_exc())
+
+def format_bytes(size) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024 :
+            return "{size:.0f} {unit}".format(size = size, unit = unit)
+        size /= 1024
+
+    return "{size:.1f} GB".format(size = size)
+# ---
+
+# Ingest projection
+def retrieve_property_size(property_value) -> int:
+    return len(json.dumps(property_value, default=str))
+
+def project_properties(data, ingest_projection) -> tuple:
+    keep_properties = set(key.lower() for key in ingest_projection["keep"])
+    drop_properties = set(key.lower() for key in ingest_projection["drop"])
+    side_properties = set(key.lower() for key in ingest_projection["side_store"])
+    max_property_bytes = ingest_projection["max_property_bytes"]
+
+    projected_bytes = 0
+    side_store = []
+
+    for node in data:
+        properties = node.get("Properties")
+        if not properties :
+            continue
+
+        stored_properties = {}
+        for property_key in list(properties.keys()):
+            property_name = property_key.lower()
+            if property_name in keep_properties :
+                continue
+
+            if property_name in drop_properties :
+                projected_bytes += retrieve_property_size(properties.pop(property_key))
+            else:
+                property_size = retrieve_property_size(properties[property_key])
+                if property_name in side_properties or property_size > max_property_bytes :
+                    stored_properties[property_key] = properties.pop(property_key)
+                    projected_bytes += property_size
+
+        if stored_properties :
+            side_store.append({"objectid": node["ObjectIdentifier"], "properties": stored_properties})
+
+    return projected_bytes, side_store
+
+def decompose_useraccountcontrol(data) -> None:
+    for node in data:
+        properties = node.get("Properties")
+        if not properties or properties.get("useraccountcontrol") is None :
+            continue
+
+        try:
+            useraccountcontrol = int(properties["useraccountcontrol"])
+        except (TypeError, ValueError):
+            continue
+
+        for flag_value, flag_name in USER_ACCOUNT_CONTROL_FLAGS.items():
+            properties["uac_" + flag_name] = (useraccountcontrol & flag_value) != 0
+
+def normalize_samaccountname(data) -> None:
+    for node in data:
+        properties = node.get("Properties")
+        if not properties or properties.get("samaccountname") is None :
+            continue
+
+        properties[NORMALIZED_SAMACCOUNTNAME] = str(properties["samaccountname"]).upper()
+
+def retrieve_side_store_path() -> str:
+    controller = N4LController().get_instance()
+    return os.path.join(controller.retrieve_data_path("side_store"), Neo4jConnector.database)
+
+# Names of every property side-stored in the current database, reported when a query asks for them
+def load_side_store_properties() -> set:
+    side_store_properties_path = os.path.join(retrieve_side_store_path(), "N4L_side_store_properties.json")
+    if not os.path.exists(side_store_properties_path) :
+        return set()
+
+    with open(side_store_properties_path, "r", encoding="utf-8") as side_store_properties_file:
+        return set(json.load(side_store_properties_file))
+
+def save_side_store_properties(side_store) -> None:
+    side_store_properties = load_side_store_properties()
+    for entry in side_store:
+        side_store_properties.update(property_key.lower() for property_key in entry["properties"])
+
+    side_store_properties_path = os.path.join(retrieve_side_store_path(), "N4L_side_store_properties.json")
+    with open(side_store_properties_path, "w", encoding="utf-8") as side_store_properties_file:
+        json.dump(sorted(side_store_properties), side_store_properties_file, indent=4)
+
+# One file per ingest, every ingested file appends its entries tagged with its path so
+# files sharing a name or ingested again never overwrite each other
+def write_side_store(ingest_id, source_path, side_store) -> None:
+    if not side_store :
+        return
+
+    side_store_path = retrieve_side_store_path()
+    os.makedirs(side_store_path, exist_ok=True)
+
+    side_store_file = os.path.join(side_store_path, ingest_id + ".jsonl")
+    with open(side_store_file, "a", encoding="utf-8") as side_store_output:
+        for entry in side_store:
+            side_store_output.write(json.dumps(dict(entry, source = source_path), default=str) + "\n")
+
+    save_side_store_properties(side_store)
 # ---
 
 def create_nodes(session, data, data_type) -> None:   
@@ -89,20 +211,27 @@ def generate_indexes(session) -> None:
         "CREATE CONSTRAINT user_objectid_constraint IF NOT EXISTS FOR (u:User) REQUIRE u.objectid IS UNIQUE",
         "CREATE CONSTRAINT gpo_objectid_constraint IF NOT EXISTS FOR (g:GPO) REQUIRE g.objectid IS UNIQUE",
         "CREATE CONSTRAINT container_objectid_constraint IF NOT EXISTS FOR (c:Container) REQUIRE c.objectid IS UNIQUE",
-        "CREATE CONSTRAINT ou_objectid_constraint IF NOT EXISTS FOR (o:OU) REQUIRE o.objectid IS UNIQUE",
-        "CREATE INDEX user_name_index IF NOT EXISTS FOR (u:User) ON (u.name)",
-        "CREATE INDEX computer_name_index IF NOT EXISTS FOR (c:Computer) ON (c.name)",
-        "CREATE INDEX group_name_index IF NOT EXISTS FOR (g:Group) ON (g.name)",
-        "CREATE INDEX gpo_name_index IF NOT EXISTS FOR (g:GPO) ON (g.name)",
-        "CREATE INDEX container_name_index IF NOT EXISTS FOR (c:Container) ON (c.name)",
-        "CREATE INDEX ou_name_index IF NOT EXISTS FOR (o:OU) ON (o.name)"
+        "CREATE CONSTRAINT ou_objectid_constraint IF NOT EXISTS FOR (o:OU) REQUIRE o.objectid IS UNIQUE"
     ]
 
+    for index_name, label, property_name in retrieve_name_indexes() + retrieve_uac_indexes() + retrieve_samaccountname_indexes():
+        indexes.append(f"CREATE INDEX {index_name} IF NOT EXISTS FOR (n:{label}) ON (n.{property_name})")
+
     for index in indexes:
         session.run(index)        
     
     session.run("CALL db.awaitIndexes()")
 
+    # Nodes ingested before the normalized samaccountname existed get it once, the index has to cover every node
+    session.run(f"""
+    MATCH (n:Base)
+    WHERE n.samaccountname IS NOT NULL AND n.{NORMALIZED_SAMACCOUNTNAME} IS NULL
+    CALL {{
+        WITH n
+        SET n.{NORMALIZED_SAMACCOUNTNAME} = toUpper(toString(n.samaccountname))
+    }} IN TRANSACTIONS OF 10000 ROWS
+    """).consume()
+
 # Post processing
 def process_laps_sync(session) -> None:
     # Get computers with LAPS
@@ -147,6 +276,95 @@ def process_laps_sync(session) -> None:
 
         run_merge_pairs_in_neo4j(session, cypher, pairs)
 
+def process_composite_aces(session) -> None:
+    # Pairs holding every required ACE get the composite ACE as a real relationship
+    for composite_ace, required_aces in COMPOSITE_ACES.items():
+        cypher = f"""
+        MATCH (src)-[:{required_aces[0]}]->(dst)
+        WHERE (src)-[:{required_aces[1]}]->(dst)
+        MERGE (src)-[:{composite_ace}]->(dst)
+        WITH src, dst
+        MATCH (src)-[r:{required_aces[0]}|{required_aces[1]}]->(dst)
+        SET r.composite_of = CASE WHEN '{composite_ace}' IN coalesce(r.composite_of, []) THEN r.composite_of ELSE coalesce(r.composite_of, []) + '{composite_ace}' END
+        """
+
+        session.run(cypher).consume()
+
+def retrieve_membership_seeds(data, data_type) -> set:
+    seeds = set()
+
+    if data_type == "Group" :
+        for node in data:
+            seeds.add(node["ObjectIdentifier"])
+            for member in node.get("Members", []):
+                seeds.add(member["ObjectIdentifier"])
+    elif data_type == "User" or data_type == "Computer" :
+        for node in data:
+            if node.get("PrimaryGroupSID") :
+                seeds.add(node["ObjectIdentifier"])
+
+    return seeds
+
+def process_membership_closure(session, seeds) -> int:
+    groups_by_member = defaultdict(set)
+    members_by_group = defaultdict(set)
+
+    result = session.run("""
+    MATCH (member)-[:MemberOf]->(group)
+    RETURN member.objectid AS member_id, group.objectid AS group_id
+    """)
+
+    for record in result:
+        groups_by_member[record["member_id"]].add(record["group_id"])
+        members_by_group[record["group_id"]].add(record["member_id"])
+
+    # Databases ingested before the closure existed get it built for every member on their next upload
+    closure_built = session.run("RETURN EXISTS { MATCH ()-[:EffectiveMemberOf]->() } AS built").single()["built"]
+    if not closure_built :
+        seeds = set(groups_by_member.keys())
+
+    # Changed nodes and every node nested below them need their closure recomputed
+    affected_nodes = set(seeds)
+    pending_nodes = list(seeds)
+    while pending_nodes:
+        for member_id in members_by_group.get(pending_nodes.pop(), ()):
+            if member_id not in affected_nodes :
+                affected_nodes.add(member_id)
+                pending_nodes.append(member_id)
+
+    rows = []
+    for member_id in affected_nodes:
+        effective_groups = set()
+        pending_groups = list(groups_by_member.get(member_id, ()))
+        while pending_groups:
+            group_id = pending_groups.pop()
+            if group_id not in effective_groups :
+                effective_groups.add(group_id)
+                pending_groups.extend(groups_by_member.get(group_id, ()))
+
+        effective_groups.discard(member_id)
+        rows.append({"MemberSID": member_id, "GroupSIDs": list(effective_groups)})
+
+    delete_cypher = """
+    UNWIND $rows AS row
+    MATCH (member:Base {objectid: row.MemberSID})-[r:EffectiveMemberOf]->()
+    DELETE r
+    """
+
+    create_cypher = """
+    UNWIND $rows AS row
+    MATCH (member:Base {objectid: row.MemberSID})
+    UNWIND row.GroupSIDs AS group_sid
+    MATCH (group:Base {objectid: group_sid})
+    MERGE (member)-[:EffectiveMemberOf]->(group)
+    """
+
+    for ini in range(0, len(rows), 1000):
+        run_merge_in_neo4j(session, delete_cypher, rows[ini:ini + 1000])
+        run_merge_in_neo4j(session, create_cypher, rows[ini:ini + 1000])
+
+    return len(rows)
+
 def process_aces(session, data) -> None:
     grouped_by_type = defaultdict(list)
 
@@ -440,6 +658,10 @@ def upload_data(json_files, workers, retries, is_legacy) -> None:
 
     controller = N4LController().get_instance()
     exception_on_upload = False
+    membership_seeds = set()
+
+    ingest_projection = controller.load_ingest_projection()
+    ingest_id = "{timestamp}_{suffix}".format(timestamp = time.strftime("%Y%m%d_%H%M%S"), suffix = uuid.uuid4().hex[:8])
 
     grouped_files = defaultdict(list)
     for path in json_files:
@@ -458,10 +680,16 @@ def upload_data(json_files, workers, retries, is_legacy) -> None:
         for full_path, file_name in file_list:
             try:
                 data, data_type = retrieve_json_info(full_path)
+
+                projected_bytes, side_store = project_properties(data, ingest_projection)
+                write_side_store(ingest_id, full_path, side_store)
+                decompose_useraccountcontrol(data)
+                normalize_samaccountname(data)
+
                 with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
                     create_nodes(session, data, data_type)
 
-                push_debug_info("    [✔] {file}".format(file = file_name))
+                push_debug_info("    [✔] {file} ({size} projected out)".format(file = file_name, size = format_bytes(projected_bytes)))
             except:
                 current_exception = traceback.format_exc()
                 push_debug_info("    [✘] {file}".format(file = file_name))
@@ -480,6 +708,7 @@ def upload_data(json_files, workers, retries, is_legacy) -> None:
                 try:
                     data, data_type = retrieve_json_info(full_path)    
                     chunks = generate_chunks(data)
+                    membership_seeds.update(retrieve_membership_seeds(data, data_type))
 
                     push_debug_info("    [#] Post-Processing {file}".format(file = file_name))
                     
@@ -513,6 +742,30 @@ def upload_data(json_files, workers, retries, is_legacy) -> None:
             if(exception_on_upload):
                 break
 
+        if(not exception_on_upload):
+            push_debug_info("::: COMPOSITE ACES :::\n")
+            try:
+                with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+                    process_composite_aces(session)
+
+                push_debug_info("    [✔] {aces}\n".format(aces = ", ".join(COMPOSITE_ACES.keys())))
+            except:
+                current_exception = traceback.format_exc()
+                push_debug_info("    [✘] {aces}\n".format(aces = ", ".join(COMPOSITE_ACES.keys())))
+                exception_on_upload = True
+
+        if(not exception_on_upload and membership_seeds):
+            push_debug_info("::: MEMBERSHIP CLOSURE :::\n")
+            try:
+                with Neo4jConnector.driver.session(database=Neo4jConnector.database) as session:
+                    refreshed_nodes = process_membership_closure(session, membership_seeds)
+
+                push_debug_info("    [✔] EffectiveMemberOf refreshed for {count} nodes\n".format(count = refreshed_nodes))
+            except:
+                current_exception = traceback.format_exc()
+                push_debug_info("    [✘] EffectiveMemberOf\n")
+                exception_on_upload = True
+
         if(not exception_on_upload):
             push_debug_info("=== COMPLETED ===\n")
         else:
@@ -522,4 +775,5 @@ def upload_data(json_files, workers, retries, is_legacy) -> None:
         push_debug_info("=== ERROR ===\n")
         controller.notify_error(current_exception)
 
+    Neo4jConnector.refresh_schema_catalog()
     controller.update_neo4j_db_stats()
\ No newline at end of file
@@ -0,0 +1,87 @@
+# EXPLAIN / PROFILE plan summaries for the debug panel
+
+PLAN_MODE_OFF = "off"
+PLAN_MODE_EXPLAIN = "explain"
+PLAN_MODE_PROFILE = "profile"
+PLAN_MODES = [PLAN_MODE_OFF, PLAN_MODE_EXPLAIN, PLAN_MODE_PROFILE]
+
+# Operators that usually mean the LDAP filter couldn't be anchored
+WARNING_OPERATORS = {
+    "AllNodesScan": "the query starts from every node in the database",
+    "CartesianProduct": "two unrelated node sets are combined row by row"
+}
+
+def apply_plan_mode(cypher_query, plan_mode) -> str:
+    if plan_mode == PLAN_MODE_EXPLAIN :
+        return "EXPLAIN " + cypher_query
+    if plan_mode == PLAN_MODE_PROFILE :
+        return "PROFILE " + cypher_query
+
+    return cypher_query
+
+# Neo4j 5 reports operators as e.g. NodeIndexSeek@neo4j
+def retrieve_operator_type(plan) -> str:
+    return plan["operatorType"].split("@")[0]
+
+def collect_plan_operators(plan) -> list:
+    operators = [plan]
+    for child in plan.get("children", []):
+        operators += collect_plan_operators(child)
+
+    return operators
+
+def describe_operator(plan) -> str:
+    details = plan.get("args", {}).get("Details")
+    if details :
+        return "{operator} ({details})".format(operator = retrieve_operator_type(plan), details = details)
+
+    return retrieve_operator_type(plan)
+
+# Plans come from the result summary as plain dicts, profiled plans add rows and dbHits
+def summarize_plan(plan) -> dict:
+    operators = collect_plan_operators(plan)
+    operator_types = [retrieve_operator_type(operator) for operator in operators]
+
+    plan_summary = {
+        "anchors": [describe_operator(operator) for operator in operators if not operator.get("children")],
+        "index_used": any("Index" in operator_type for operator_type in operator_types),
+        "estimated_rows": plan.get("args", {}).get("EstimatedRows"),
+        "rows": plan.get("rows"),
+        "db_hits": None,
+        "warnings": [operator_type for operator_type in WARNING_OPERATORS if operator_type in operator_types]
+    }
+
+    if "dbHits" in plan :
+        plan_summary["db_hits"] = sum(operator.get("dbHits", 0) for operator in operators)
+
+    return plan_summary
+
+def format_plan_summary(plan_summary, plan_mode) -> str:
+    lines = ["[•] Query plan ({mode})\n".format(mode = plan_mode.upper())]
+
+    lines.append("Anchor: {anchors}".format(anchors = ", ".join(plan_summary["anchors"])))
+    lines.append("Index used: {index_used}".format(index_used = "yes" if plan_summary["index_used"] else "no"))
+
+    if plan_summary["estimated_rows"] != None :
+        lines.append("Estimated rows: {rows:.0f}".format(rows = plan_summary["estimated_rows"]))
+    if plan_summary["rows"] != None :
+        lines.append("Actual rows: {rows}".format(rows = plan_summary["rows"]))
+    if plan_summary["db_hits"] != None :
+        lines.append("DB hits: {db_hits}".format(db_hits = plan_summary["db_hits"]))
+
+    for warning in plan_summary["warnings"]:
+        lines.append("[!] {operator}: {reason}".format(operator = warning, reason = WARNING_OPERATORS[warning]))
+
+    return "\n".join(lines) + "\n"
+
+# Queries over any of the thresholds end up in the slow query log, a threshold of 0 disables it
+def is_slow_query(elapsed_ms, db_hits, query_settings) -> bool:
+    time_threshold = query_settings["slow_query_threshold_ms"]
+    if time_threshold > 0 and elapsed_ms >= time_threshold :
+        return True
+
+    db_hits_threshold = query_settings["slow_query_db_hits_threshold"]
+    if db_hits_threshold > 0 and db_hits != None :
+        return db_hits >= db_hits_threshold
+
+    return False